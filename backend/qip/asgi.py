@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
+from channels.routing import ProtocolTypeRouter
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qip.settings')
 
-application = get_asgi_application()
+# Sets up Django before the routing imports the models
+django_application = get_asgi_application()
+
+from .routing import websocket_application, channel_application  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_application,
+    'websocket': websocket_application,
+    'channel': channel_application,
+})
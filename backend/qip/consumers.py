@@ -1,16 +1,48 @@
-from channels.generic.websocket import AsyncWebsocketConsumer
-import json
+from channels.consumer import SyncConsumer
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.db import close_old_connections
+from qipu_api import media_processing
+from qipu_api.signals import timeline_group
+
+
+class TimelineConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes the created/updated/deleted posts, media and events of the
+    authenticated user, so the Dashboard patches its lists in place instead
+    of fetching them again.
+    """
+    group_name = None
 
-class MyConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.group_name = timeline_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
     async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # Server push only
         pass
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        # process data
-        await self.send(text_data=json.dumps({
-            'message': 'data received'
-        }))
\ No newline at end of file
+    async def timeline_delta(self, event):
+        await self.send_json({'deltas': event['deltas']})
+
+
+class MediaProcessingConsumer(SyncConsumer):
+    """
+    Background worker building thumbnails and posters of new media, run with
+    `python manage.py runworker media-processing`.
+    """
+
+    def process_media(self, message):
+        close_old_connections()
+        try:
+            media_processing.process_media(message['media_id'])
+        finally:
+            close_old_connections()
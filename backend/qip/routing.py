@@ -1,11 +1,21 @@
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, URLRouter
+from channels.security.websocket import OriginValidator
+from channels.sessions import CookieMiddleware
+from django.conf import settings
 from django.urls import path
-from .consumers import MyConsumer
+from qipu_api.utility import JWTCookieAuthMiddleware
+from .consumers import TimelineConsumer, MediaProcessingConsumer
 
 websocket_urlpatterns = [
-    path('ws/some_path/', MyConsumer.as_asgi()),
+    path('ws/timeline/', TimelineConsumer.as_asgi()),
 ]
 
-application = ProtocolTypeRouter({
-    'websocket': URLRouter(websocket_urlpatterns)
-})
\ No newline at end of file
+# The token comes from a cookie, so only the frontend origins may connect
+websocket_application = OriginValidator(
+    CookieMiddleware(JWTCookieAuthMiddleware(URLRouter(websocket_urlpatterns))),
+    settings.CORS_ALLOWED_ORIGINS,
+)
+
+channel_application = ChannelNameRouter({
+    settings.MEDIA_PROCESSING_CHANNEL: MediaProcessingConsumer.as_asgi(),
+})
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_extensions',
     'rest_framework',
     'corsheaders',
@@ -71,10 +72,11 @@ WEBPACK_LOADER = {
 
 
 MIDDLEWARE = [
+    'qipu_api.utility.PerformanceMiddleware',
+    'qipu_api.utility.RequestLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'qipu_api.utility.TokenFromCookieMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'qipu_api.utility.RedirectAuthenticatedUserMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +88,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'qip.urls'
 
+# Per-request timings in Server-Timing headers and in the metrics/ endpoint
+PERF_INSTRUMENTATION = os.environ.get('PERF_INSTRUMENTATION', 'false').lower() == 'true'
+
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
@@ -110,12 +115,16 @@ TEMPLATES = [
 ]
 
 REST_FRAMEWORK = {
+    # Token first: a request carrying one is never looked up in the session
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'qipu_api.authentication.CookieJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
 }
 
+# Default page size of the cursor-paginated media and posts lists
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+
 CORS_ALLOW_ALL_ORIGINS = False
 
 CORS_ALLOWED_ORIGINS = [
@@ -132,6 +141,7 @@ CORS_ALLOW_HEADERS = [
     'origin',
     'x-requested-with',
     'x-goog-resumable',
+    'content-range',
 ]
 CORS_ALLOW_METHODS = [
     'GET',
@@ -181,6 +191,20 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Tests swap in the in-memory channel layer
+TEST_RUNNER = 'qipu_api.test_runner.TestRunner'
+
+# Cache
+# Shared by all workers. Run Redis with maxmemory-policy allkeys-lru so the
+# least recently used entries are evicted first when memory runs out.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    }
+}
+
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
@@ -202,12 +226,78 @@ DATABASES = {
 # Il y a certainement des choses à rajouter dans le fichier .ENV, à vérifier
 
 DEFAULT_FILE_STORAGE = 'qipu_api.utility.CustomGoogleCloudStorage'
-GS_BUCKET_NAME = os.environ['GS_BUCKET_NAME']
-GS_PROJECT_ID = os.environ['GS_PROJECT_ID']
+GS_BUCKET_NAME = os.environ.get('GS_BUCKET_NAME', 'qip_media')
+GS_PROJECT_ID = os.environ.get('GS_PROJECT_ID')
 # GS_MEDIA_BUCKET_NAME = 'your-media-bucket-name'
-GS_CREDENTIALS = service_account.Credentials.from_service_account_file(
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS']
-)
+# Only the gcs backend needs them, the others run without any Google account
+GS_CREDENTIALS = None
+if os.environ.get('GOOGLE_APPLICATION_CREDENTIALS'):
+    GS_CREDENTIALS = service_account.Credentials.from_service_account_file(
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS']
+    )
+
+# Where the media objects live: 'gcs', 'filesystem' (files under
+# OBJECT_STORAGE_ROOT) or 'memory' (this process, for tests and load tests).
+# The last two are served by ObjectStorageView at OBJECT_STORAGE_URL, through
+# URLs signed with OBJECT_STORAGE_SIGNING_KEY.
+OBJECT_STORAGE_BACKEND = os.environ.get('OBJECT_STORAGE_BACKEND', 'gcs')
+OBJECT_STORAGE_ROOT = os.environ.get('OBJECT_STORAGE_ROOT', str(BACKEND_DIR / 'objects'))
+OBJECT_STORAGE_URL = os.environ.get('OBJECT_STORAGE_URL', 'http://localhost:8000/storage/')
+OBJECT_STORAGE_SIGNING_KEY = os.environ.get('OBJECT_STORAGE_SIGNING_KEY', SECRET_KEY)
+
+# Local fake GCS server (e.g. fake-gcs-server) to use instead of Google Cloud Storage
+GS_EMULATOR_HOST = os.environ.get('STORAGE_EMULATOR_HOST')
+# HTTP connection pool of the storage client shared by the whole process
+GS_HTTP_POOL_CONNECTIONS = int(os.environ.get('GS_HTTP_POOL_CONNECTIONS', 10))
+GS_HTTP_POOL_MAXSIZE = int(os.environ.get('GS_HTTP_POOL_MAXSIZE', 32))
+GS_HTTP_MAX_RETRIES = 3
+
+# Signed URLs are reused from the cache until they are this close to expiry
+SIGNED_URL_EXPIRATION = timedelta(minutes=60)
+SIGNED_URL_REFRESH_MARGIN = timedelta(minutes=5)
+SIGNED_URL_CACHE_ALIAS = 'default'
+# Entries kept in each process in front of the shared cache
+SIGNED_URL_CACHE_SIZE = 1024
+# Threads signing URLs in parallel for the batch media-detail endpoint
+SIGNED_URL_MAX_WORKERS = int(os.environ.get('SIGNED_URL_MAX_WORKERS', 8))
+
+# What token authentication checks of a user (is_active, password hash digest),
+# read from the cache instead of the database. Saving a user moves it to a new
+# version, other processes may still serve theirs for USER_CACHE_LOCAL_TIMEOUT
+# seconds (e.g. after a deactivation).
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 300))
+USER_CACHE_LOCAL_TIMEOUT = int(os.environ.get('USER_CACHE_LOCAL_TIMEOUT', 10))
+USER_CACHE_SIZE = 1024
+
+# Serialized tag catalogue and per-user tag lists, versioned by write signals
+TAG_CACHE_ALIAS = 'default'
+TAG_CACHE_TIMEOUT = int(os.environ.get('TAG_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Per-user contact adjacency, versioned by the contact and label signals
+CONTACT_GRAPH_CACHE_ALIAS = 'default'
+CONTACT_GRAPH_CACHE_TIMEOUT = int(os.environ.get('CONTACT_GRAPH_CACHE_TIMEOUT', 60 * 60))
+
+# Expanded occurrences of a recurring event for one requested window
+RECURRENCE_CACHE_TIMEOUT = int(os.environ.get('RECURRENCE_CACHE_TIMEOUT', 60 * 60))
+
+# Resumable uploads: largest accepted file, and chunk size suggested to clients
+# (a multiple of 256 KiB)
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 5 * 1024 ** 3))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 ** 2))
+UPLOAD_CONTENT_TYPES = ('image/', 'video/')
+
+# Media processing workers: python manage.py runworker media-processing
+MEDIA_PROCESSING_CHANNEL = 'media-processing'
+# Longest edge of the JPEG derivatives, in pixels
+MEDIA_DERIVATIVE_SIZES = (160, 480, 1280)
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+# Seconds an ffmpeg/ffprobe call may take
+MEDIA_PROCESSING_TIMEOUT = int(os.environ.get('MEDIA_PROCESSING_TIMEOUT', 120))
+# Seconds past MEDIA_PROCESSING_TIMEOUT after which a media still being
+# processed is taken to belong to a dead worker and may be claimed again
+MEDIA_PROCESSING_STALE_MARGIN = int(os.environ.get('MEDIA_PROCESSING_STALE_MARGIN', 600))
 
 
 # Password validation
@@ -256,6 +346,52 @@ STATICFILES_DIRS = [
 #     BASE_DIR / 'dist',
 # ]
 
+# Logging
+# Records go through a queue to a background writer thread, as JSON lines.
+# Per-logger levels can be set with LOG_LEVELS="qipu_api.utility=DEBUG,...",
+# and REQUEST_LOG_SAMPLE_RATE is the share of successful requests logged.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'redact_tokens': {
+            '()': 'qipu_api.logs.RedactTokenFilter',
+        },
+        'sample_requests': {
+            '()': 'qipu_api.logs.SamplingFilter',
+            'rate': float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 0.01)),
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'qipu_api.logs.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'queue': {
+            'class': 'qipu_api.logs.NonBlockingHandler',
+            'formatter': 'json',
+            'filters': ['redact_tokens'],
+        },
+    },
+    'loggers': {
+        'qipu_api': {
+            'handlers': ['queue'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'qipu_api.requests': {
+            'filters': ['sample_requests'],
+        },
+    },
+}
+
+for logger_level in filter(None, os.environ.get('LOG_LEVELS', '').split(',')):
+    logger_name, level = logger_level.split('=')
+    LOGGING['loggers'].setdefault(logger_name.strip(), {})['level'] = level.strip().upper()
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class QipuApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'qipu_api'
+
+    def ready(self):
+        from . import signals
+        signals.connect()
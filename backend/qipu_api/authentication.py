@@ -0,0 +1,138 @@
+# authentication.py
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from . import metrics, versioned_cache
+
+
+# Set by set_token_cookie at login
+TOKEN_COOKIE = 'authToken'
+
+# All token authentication reads of a user, the password hash itself is never cached
+AuthFields = namedtuple('AuthFields', ['id', 'is_active', 'password_digest'])
+
+
+class UserCache:
+    """
+    AuthFields of users by id: the shared Django cache under a version per
+    user that saving bumps, with a small per-process LRU in front whose
+    entries only live `local_timeout` seconds.
+    """
+
+    def __init__(self, alias='default', timeout=300, local_timeout=10, max_entries=1024):
+        self.alias = alias
+        self.timeout = timeout
+        self.local_timeout = local_timeout
+        self.max_entries = max_entries
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(user_id):
+        return f'auth:user:{user_id}'
+
+    def get(self, user_id):
+        """The AuthFields of a user, None if it does not exist."""
+        # Token claims may hold the id as a string
+        key = self.make_key(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._local.move_to_end(key)
+                    metrics.record_cache(hit=True)
+                    return entry[0]
+                del self._local[key]
+
+        # Read before the row, a save committing in between moves past it
+        shared_key = f'{key}:{versioned_cache.get_version(key, self.alias)}'
+        fields = caches[self.alias].get(shared_key)
+        metrics.record_cache(hit=fields is not None)
+        if fields is None:
+            row = get_user_model()._default_manager.filter(pk=user_id).values_list(
+                'id', 'is_active', 'password').first()
+            if row is None:
+                return None
+            user_id, is_active, password = row
+            fields = AuthFields(user_id, is_active, get_md5_hash_password(password))
+            caches[self.alias].set(shared_key, fields, timeout=self.timeout)
+        self._remember(key, (fields, now + self.local_timeout))
+        return fields
+
+    def invalidate(self, user_id):
+        """Moves the user to a new version once the transaction commits, a read before it would cache the old row."""
+        key = self.make_key(user_id)
+        versioned_cache.invalidate(key, alias=self.alias)
+
+        def drop():
+            with self._lock:
+                self._local.pop(key, None)
+        transaction.on_commit(drop)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+
+user_cache = UserCache(
+    alias=settings.USER_CACHE_ALIAS,
+    timeout=settings.USER_CACHE_TIMEOUT,
+    local_timeout=settings.USER_CACHE_LOCAL_TIMEOUT,
+    max_entries=settings.USER_CACHE_SIZE,
+)
+
+
+class CookieJWTAuthentication(JWTAuthentication):
+    """
+    JWT from the Authorization header or else the authToken cookie, with the
+    user checked through user_cache instead of a query per request. Listed
+    before SessionAuthentication so token requests never load the session.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        raw_token = None if header is None else self.get_raw_token(header)
+        if raw_token is None:
+            raw_token = request.COOKIES.get(TOKEN_COOKIE)
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        # JWTAuthentication.get_user with the cached lookup
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        fields = user_cache.get(user_id)
+        if fields is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not fields.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM) != fields.password_digest:
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        # As loaded by .only('id', 'is_active'), any other field is read on access
+        User = get_user_model()
+        return User.from_db(router.db_for_read(User), ['id', 'is_active'], [fields.id, fields.is_active])
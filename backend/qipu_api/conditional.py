@@ -0,0 +1,58 @@
+# conditional.py
+
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+class ConditionalListMixin:
+    """
+    Conditional GET for list(): answers If-None-Match / If-Modified-Since with
+    a 304 before the rows are read or serialized.
+
+    The collection version is one aggregate over the filtered queryset, its
+    row count and latest `modified_field`. The count catches deletes, the
+    timestamp catches inserts and edits. The ETag hashes it with the user and
+    the full path, so pages, filters and users never share a validator.
+    Last-Modified cannot see deletes, If-None-Match (sent along by browsers)
+    takes precedence over it.
+    """
+    modified_field = 'updated_at'
+
+    def get_collection_version(self):
+        """Returns (version, last_modified datetime or None)."""
+        stats = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            count=Count('pk'), last_modified=Max(self.modified_field))
+        last_modified = stats['last_modified']
+        stamp = last_modified.timestamp() if last_modified else 0
+        return f"{stats['count']}:{stamp}", last_modified
+
+    def get_etag(self, request, version):
+        key = f'{request.user.pk}:{request.get_full_path()}:{version}'
+        return quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+    def conditional_response(self, request, build_response):
+        version, last_modified = self.get_collection_version()
+        etag = self.get_etag(request, version)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        precondition = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if precondition is None:
+            response = build_response()
+        else:
+            # 304, or 412 for a failed If-Match, without a body
+            response = Response(status=precondition.status_code)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        # Browsers keep the body and revalidate it on every request
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, lambda: super(ConditionalListMixin, self).list(request, *args, **kwargs))
@@ -0,0 +1,95 @@
+# contact_graph.py
+
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from django.db.models import Q
+from . import versioned_cache
+from .models import Contact
+
+
+ACCEPTED = 'accepted'
+INBOX = 'inbox'
+OUTBOX = 'outbox'
+
+# Bumped when labels are edited or deleted, these reach every adjacency
+LABELS = 'contacts:labels'
+
+
+def adjacency_name(user_id):
+    return f'contacts:user:{user_id}'
+
+
+def build_adjacency(user_id):
+    """
+    User ids around user_id as sorted int64 arrays: accepted contacts, pending
+    requests received (inbox) and sent (outbox), and the accepted contacts of
+    each relationship label.
+    """
+    ids = {ACCEPTED: set(), INBOX: set(), OUTBOX: set()}
+    contacts = {}
+    for pk, requester_id, recipient_id, status in Contact.objects.filter(
+            Q(requester_id=user_id) | Q(recipient_id=user_id)).values_list(
+            'pk', 'requester_id', 'recipient_id', 'status'):
+        other = recipient_id if requester_id == user_id else requester_id
+        if status == 'accepted':
+            ids[ACCEPTED].add(other)
+            contacts[pk] = other
+        elif status == 'pending':
+            ids[INBOX if recipient_id == user_id else OUTBOX].add(other)
+
+    labels = {}
+    for contact_id, label_id in Contact.labels.through.objects.filter(
+            contact_id__in=list(contacts)).values_list('contact_id', 'relationshiplabel_id'):
+        labels.setdefault(label_id, set()).add(contacts[contact_id])
+
+    adjacency = {name: array('q', sorted(members)) for name, members in ids.items()}
+    adjacency['labels'] = {label_id: array('q', sorted(members)) for label_id, members in labels.items()}
+    return adjacency
+
+
+def get_adjacency(user_id):
+    return versioned_cache.cached_data(
+        [LABELS, adjacency_name(user_id)], lambda: build_adjacency(user_id),
+        settings.CONTACT_GRAPH_CACHE_TIMEOUT, settings.CONTACT_GRAPH_CACHE_ALIAS)
+
+
+def invalidate(*user_ids):
+    versioned_cache.invalidate(*(adjacency_name(user_id) for user_id in user_ids),
+                               alias=settings.CONTACT_GRAPH_CACHE_ALIAS)
+
+
+def invalidate_labels():
+    versioned_cache.invalidate(LABELS, alias=settings.CONTACT_GRAPH_CACHE_ALIAS)
+
+
+def intersect(first, second):
+    """Sorted common ids of two sorted arrays, by binary search in the larger one."""
+    if len(first) > len(second):
+        first, second = second, first
+    common = []
+    low = 0
+    for value in first:
+        low = bisect_left(second, value, low)
+        if low == len(second):
+            break
+        if second[low] == value:
+            common.append(value)
+    return common
+
+
+def contains(ids, value):
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+def mutual_contacts(user_id, other_id):
+    """
+    Accepted contacts the users have in common, None unless other_id is the
+    user or one of their accepted contacts: the contacts of strangers stay
+    out of reach.
+    """
+    accepted = get_adjacency(user_id)[ACCEPTED]
+    if other_id != user_id and not contains(accepted, other_id):
+        return None
+    return intersect(accepted, get_adjacency(other_id)[ACCEPTED])
@@ -0,0 +1,103 @@
+# logs.py
+
+import json
+import logging
+import queue
+import random
+import re
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+JWT_PATTERN = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]*')
+BEARER_PATTERN = re.compile(r'(Bearer\s+)\S+', re.IGNORECASE)
+SENSITIVE_KEYS = {'token', 'authorization', 'password', 'signed_url'}
+
+
+def redact(value):
+    """Masks JWTs and bearer credentials found in a string."""
+    value = JWT_PATTERN.sub('[redacted]', value)
+    return BEARER_PATTERN.sub(r'\1[redacted]', value)
+
+
+class RedactTokenFilter(logging.Filter):
+    """Strips tokens from the message and from sensitive `extra` fields."""
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = redact(message)
+        if redacted != message:
+            record.msg, record.args = redacted, None
+        for key in SENSITIVE_KEYS:
+            if key in record.__dict__:
+                setattr(record, key, '[redacted]')
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` fraction of the records below WARNING, and every record above."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra` fields as top-level keys."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class NonBlockingHandler(QueueHandler):
+    """
+    Puts records on an in-memory queue written out by a background thread, so
+    the request thread never waits on stdout/stderr. When the queue is full
+    records are dropped rather than blocking.
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream)
+        self.target.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+    def close(self):
+        # Called by logging.shutdown() at exit, flushes what is left in the queue
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,195 @@
+# benchmark_indexes.py
+
+import time
+from datetime import timedelta
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.functions import Collate, Upper
+from django.utils import timezone
+from qipu_api.occurrences import overlapping
+from qipu_api.models import User, Media, Post, Event, Tag, UserTag, PostTag, MediaTag
+
+
+# Indexes added by 0004_composite_indexes, 0005_tag_name_search_indexes and
+# 0009_event_extent_index, dropped for the "before" plans
+INDEXES = [
+    'media_user_created_idx',
+    'post_user_created_idx',
+    'event_user_created_idx',
+    'mediatag_tag_media_idx',
+    'posttag_tag_post_idx',
+    'usertag_object_idx',
+    'tag_name_trgm_idx',
+    'tag_name_prefix_idx',
+    'event_user_extent_idx',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a large synthetic dataset and prints the query plans of the "
+        "hot Media/Post/Event/tag queries without and with the composite "
+        "and tag search indexes. Everything runs in one transaction that is "
+        "rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of posts and of media to seed.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write('This benchmark needs PostgreSQL.')
+            return
+        try:
+            with transaction.atomic():
+                started = time.monotonic()
+                self.seed(options['rows'], options['users'], options['tags'])
+                self.stdout.write(
+                    f"Seeded in {time.monotonic() - started:.1f}s")
+                queries = self.hot_queries()
+
+                sid = transaction.savepoint()
+                with connection.cursor() as cursor:
+                    for index in INDEXES:
+                        cursor.execute(f'DROP INDEX "{index}"')
+                self.explain_all('WITHOUT composite indexes', queries)
+                transaction.savepoint_rollback(sid)
+
+                self.explain_all('WITH composite indexes', queries)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows, users, tags):
+        user_table = User._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {user_table} (password, is_superuser, is_staff,
+                    is_active, date_joined, created_time, first_name,
+                    last_name, username, email, picture, bio)
+                SELECT '!', false, false, true, now(), now(), 'Bench',
+                    'User', 'bench' || i, 'bench' || i || '@example.com',
+                    'default_profile_picture.jpg', 'Benchmark user'
+                FROM generate_series(1, %s) AS i
+            """, [users])
+            cursor.execute(f"""
+                INSERT INTO {Tag._meta.db_table} (name, description)
+                SELECT 'bench-tag-' || i, '' FROM generate_series(1, %s) AS i
+            """, [tags])
+
+            # Users and tags are picked uniformly, dates spread over ten years
+            cursor.execute(f"""
+                CREATE TEMP TABLE bench_users ON COMMIT DROP AS
+                SELECT row_number() OVER () AS n, id FROM {user_table}
+                WHERE username LIKE 'bench%'
+            """)
+            cursor.execute(f"""
+                CREATE TEMP TABLE bench_tags ON COMMIT DROP AS
+                SELECT row_number() OVER () AS n, id FROM {Tag._meta.db_table}
+                WHERE name LIKE 'bench-tag-%'
+            """)
+            cursor.execute(f"""
+                INSERT INTO {Post._meta.db_table} (created_time, updated_at,
+                    user_id, content)
+                SELECT now() - random() * interval '3650 days', now(), u.id,
+                    'Post ' || i
+                FROM generate_series(1, %s) AS i
+                JOIN bench_users u ON u.n = 1 + i %% %s
+            """, [rows, users])
+            cursor.execute(f"""
+                INSERT INTO {Media._meta.db_table} (created_time, updated_at,
+                    user_id, caption, media_type, permalink, shortcode,
+                    storage_file, is_published, category, derivatives,
+                    processing_status)
+                SELECT now() - random() * interval '3650 days', now(), u.id,
+                    'Media ' || i, 'image', '', 'm' || i,
+                    'media_files/bench/' || i || '.jpg', true, 1, '{{}}', 'done'
+                FROM generate_series(1, %s) AS i
+                JOIN bench_users u ON u.n = 1 + i %% %s
+            """, [rows, users])
+            cursor.execute(f"""
+                INSERT INTO {Event._meta.db_table} (created_time, updated_at,
+                    user_id, title, description, location, start_time,
+                    end_time, rrule, is_cancelled)
+                SELECT t, t, u.id, 'Event ' || i, '', '', t,
+                    t + interval '1 hour', '', false
+                FROM (SELECT i, now() - random() * interval '3650 days' AS t
+                      FROM generate_series(1, %s) AS i) s
+                JOIN bench_users u ON u.n = 1 + i %% %s
+            """, [max(rows // 10, 1), users])
+            cursor.execute(f"""
+                INSERT INTO {PostTag._meta.db_table} (post_id, tag_id)
+                SELECT p.id, t.id
+                FROM (SELECT id, 1 + floor(random() * %s)::int AS n
+                      FROM {Post._meta.db_table}
+                      WHERE content LIKE 'Post %%') p
+                JOIN bench_tags t ON t.n = p.n
+            """, [tags])
+            cursor.execute(f"""
+                INSERT INTO {MediaTag._meta.db_table} (media_id, tag_id)
+                SELECT m.id, t.id
+                FROM (SELECT id, 1 + floor(random() * %s)::int AS n
+                      FROM {Media._meta.db_table}
+                      WHERE shortcode LIKE 'm%%') m
+                JOIN bench_tags t ON t.n = m.n
+            """, [tags])
+            cursor.execute(f"""
+                INSERT INTO {UserTag._meta.db_table} (user_id, tag_id,
+                    content_type_id, object_id)
+                SELECT p.user_id, pt.tag_id, ct.id, p.id
+                FROM {PostTag._meta.db_table} pt
+                JOIN {Post._meta.db_table} p ON p.id = pt.post_id
+                JOIN django_content_type ct
+                    ON ct.app_label = 'qipu_api' AND ct.model = 'post'
+                WHERE p.content LIKE 'Post %'
+            """)
+            for model in (User, Tag, Post, Media, Event, PostTag, MediaTag, UserTag):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def hot_queries(self):
+        user = User.objects.filter(username='bench1').get()
+        tag = Tag.objects.get(name='bench-tag-1')
+        post = Post.objects.filter(user=user).first()
+        week = timezone.now() - timedelta(days=365)
+        return {
+            'posts page': Post.objects.filter(
+                user=user).order_by('-created_time', '-id')[:51],
+            'media page': Media.objects.filter(
+                user=user).order_by('-created_time', '-id')[:51],
+            'events by user': Event.objects.filter(
+                user=user).order_by('-created_time')[:51],
+            'events in a week': overlapping(
+                Event.objects.filter(user=user), week, week + timedelta(days=7)),
+            'events in a month, all users': overlapping(
+                Event.objects.all(), week, week + timedelta(days=30)),
+            'posts by tag': Post.objects.filter(
+                posttag__tag__id__in=[tag.id], user=user),
+            'media by tag': Media.objects.filter(
+                mediatag__tag__id__in=[tag.id], user=user),
+            'user tags of an object': UserTag.objects.filter(
+                content_type=ContentType.objects.get_for_model(Post),
+                object_id=post.id),
+            'tag search, prefix': Tag.objects.annotate(
+                name_key=Collate(Upper('name'), 'C')).filter(
+                name_key__startswith='BENCH-TAG-12').order_by('name_key')[:50],
+            'tag search, substring': Tag.objects.filter(
+                name__icontains='tag-12')[:50],
+        }
+
+    def explain_all(self, title, queries):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {title} ==="))
+        with connection.cursor() as cursor:
+            for name, queryset in queries.items():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+                self.stdout.write(self.style.SUCCESS(f"\n-- {name}"))
+                for (line,) in cursor.fetchall():
+                    self.stdout.write(line)
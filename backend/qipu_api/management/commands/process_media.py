@@ -0,0 +1,42 @@
+# process_media.py
+
+from django.core.management.base import BaseCommand, CommandError
+from qipu_api import media_processing
+from qipu_api.models import Media
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the thumbnails and posters of media in this process: the given "
+        "ids, or with --pending the backlog the workers have not processed "
+        "(e.g. queued while no worker was running, or left by a worker that died)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int)
+        parser.add_argument('--pending', action='store_true',
+                            help='Process every pending media.')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Include the media whose processing failed.')
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            ids = options['ids']
+        elif options['pending']:
+            statuses = [media_processing.PENDING]
+            if options['retry_failed']:
+                statuses.append(media_processing.FAILED)
+            # Includes the media a dead worker left processing
+            ids = Media.objects.filter(media_processing.claimable(statuses)).order_by(
+                'pk').values_list('pk', flat=True)[:options['limit']]
+        else:
+            raise CommandError('Give media ids or --pending')
+
+        done = failed = 0
+        for media_id in ids:
+            if media_processing.process_media(media_id):
+                done += 1
+            else:
+                failed += 1
+        self.stdout.write(f"Processed {done} media, {failed} failed or already taken")
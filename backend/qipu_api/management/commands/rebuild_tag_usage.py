@@ -0,0 +1,66 @@
+# rebuild_tag_usage.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+
+# What qipu_api_tagusage should contain, computed from the link tables
+COUNTS_SQL = """
+SELECT user_id, tag_id, sum(posts) AS post_count, sum(media) AS media_count
+FROM (
+    SELECT p.user_id, pt.tag_id, count(*) AS posts, 0 AS media
+    FROM qipu_api_posttag pt JOIN qipu_api_post p ON p.id = pt.post_id
+    GROUP BY p.user_id, pt.tag_id
+    UNION ALL
+    SELECT m.user_id, mt.tag_id, 0, count(*)
+    FROM qipu_api_mediatag mt JOIN qipu_api_media m ON m.id = mt.media_id
+    GROUP BY m.user_id, mt.tag_id
+) counts
+GROUP BY user_id, tag_id
+"""
+
+DRIFT_SQL = f"""
+SELECT coalesce(e.user_id, u.user_id), coalesce(e.tag_id, u.tag_id),
+    coalesce(e.post_count, 0), u.post_count,
+    coalesce(e.media_count, 0), u.media_count
+FROM ({COUNTS_SQL}) e
+FULL JOIN qipu_api_tagusage u ON u.user_id = e.user_id AND u.tag_id = e.tag_id
+WHERE e.user_id IS NULL OR u.user_id IS NULL
+    OR e.post_count <> u.post_count OR e.media_count <> u.media_count
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the per-user tag counters (TagUsage) from PostTag and "
+        "MediaTag, then verifies them. With --check, only reports drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only compare the counters, exit with an error on drift.')
+        parser.add_argument('--show', type=int, default=20,
+                            help='Number of drifting rows to print.')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Triggers of concurrent writes wait until the new rows are in
+                cursor.execute('LOCK TABLE qipu_api_tagusage IN EXCLUSIVE MODE')
+                cursor.execute('DELETE FROM qipu_api_tagusage')
+                cursor.execute(f"""
+                    INSERT INTO qipu_api_tagusage (user_id, tag_id, post_count, media_count)
+                    {COUNTS_SQL}
+                """)
+                self.stdout.write(f"Rebuilt {cursor.rowcount} tag counters")
+
+        with connection.cursor() as cursor:
+            cursor.execute(DRIFT_SQL)
+            drift = cursor.fetchall()
+        for user_id, tag_id, posts, stored_posts, media, stored_media in drift[:options['show']]:
+            self.stdout.write(
+                f"user {user_id} tag {tag_id}: posts {stored_posts} (expected {posts}), "
+                f"media {stored_media} (expected {media})")
+        if drift:
+            raise CommandError(f"{len(drift)} tag counters differ from PostTag/MediaTag")
+        self.stdout.write(self.style.SUCCESS('Tag counters are consistent'))
@@ -0,0 +1,185 @@
+# media_processing.py
+
+import io
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import metrics
+from .models import Media
+from .object_storage import get_object_storage
+from .utility import media_object_name
+
+
+logger = logging.getLogger(__name__)
+
+PENDING, PROCESSING, DONE, FAILED = 'pending', 'processing', 'done', 'failed'
+
+
+def derivative_name(media, size):
+    # Media of the same StoredObject share the derivatives of its bytes
+    if media.stored_object_id is not None:
+        return f'derived/objects/{media.stored_object_id}/{size}.jpg'
+    return f'derived/{media.pk}/{size}.jpg'
+
+
+def pick_object(media, size=None):
+    """
+    Object to serve for a display of size pixels (longest edge): the smallest
+    derivative at least that big, the original when there is none. Derivatives
+    of a video are stills of its poster frame.
+    """
+    original = media_object_name(media.storage_file.name)
+    if size is None:
+        return original
+    sizes = sorted(int(key) for key in media.derivatives)
+    for candidate in sizes:
+        if candidate >= size:
+            return media.derivatives[str(candidate)]
+    if media.media_type == 'video' and sizes:
+        # The original would be the whole video, the largest still fits best
+        return media.derivatives[str(sizes[-1])]
+    return original
+
+
+def enqueue(media_ids):
+    """
+    Hands the media to the processing workers once the transaction commits.
+    Messages lost while no worker runs are picked up by `process_media --pending`.
+    """
+    media_ids = list(media_ids)
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            for media_id in media_ids:
+                async_to_sync(channel_layer.send)(settings.MEDIA_PROCESSING_CHANNEL, {
+                    'type': 'process.media', 'media_id': media_id})
+        except Exception:
+            logger.warning('Could not queue media processing', exc_info=True,
+                           extra={'count': len(media_ids)})
+    if media_ids:
+        transaction.on_commit(send)
+
+
+def run(command):
+    return subprocess.run(command, check=True, capture_output=True,
+                          timeout=settings.MEDIA_PROCESSING_TIMEOUT).stdout
+
+
+def probe_video(path):
+    """(width, height, duration in seconds) of the first video stream."""
+    info = json.loads(run([
+        settings.FFPROBE_BINARY, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height:format=duration', '-of', 'json', path]))
+    stream = info['streams'][0]
+    duration = info.get('format', {}).get('duration')
+    return stream['width'], stream['height'], float(duration) if duration else None
+
+
+def extract_poster(path, duration):
+    """JPEG bytes of a frame a little into the video, past fade-ins."""
+    offset = min(1.0, duration / 2) if duration else 0
+    return run([
+        settings.FFMPEG_BINARY, '-v', 'error', '-ss', str(offset), '-i', path,
+        '-frames:v', '1', '-f', 'image2', '-c:v', 'mjpeg', '-'])
+
+
+def thumbnails(image_file):
+    """(width, height, {size: JPEG bytes}) for every configured size below the image's."""
+    # Pillow is only needed by the processing workers
+    from PIL import Image, ImageOps
+
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        image = image.convert('RGB')
+        derived = {}
+        for size in sorted(settings.MEDIA_DERIVATIVE_SIZES):
+            if size >= max(width, height):
+                break
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            thumbnail.save(output, 'JPEG', quality=82, optimize=True, progressive=True)
+            derived[size] = output.getvalue()
+    return width, height, derived
+
+
+def derive(media, path):
+    """Probes the original at path and builds its derivatives."""
+    if media.media_type == 'video':
+        width, height, duration = probe_video(path)
+        _, _, derived = thumbnails(io.BytesIO(extract_poster(path, duration)))
+        return width, height, duration, derived
+    width, height, derived = thumbnails(path)
+    return width, height, None, derived
+
+
+def claimable(statuses):
+    """
+    Media in one of statuses, or left processing by a worker that died: one
+    claimed longer ago than any processing can take.
+    """
+    stale = timezone.now() - timedelta(
+        seconds=settings.MEDIA_PROCESSING_TIMEOUT + settings.MEDIA_PROCESSING_STALE_MARGIN)
+    return Q(processing_status__in=statuses) | Q(processing_status=PROCESSING, updated_at__lt=stale)
+
+
+def process_media(media_id):
+    """
+    Downloads the original, stores its derivatives next to it in the bucket
+    and records them with the probed dimensions. Claiming the row first keeps
+    two workers from processing the same media. A deduplicated upload takes
+    those of another media of its StoredObject when there is one.
+    """
+    # updated_at moves with every change, list ETags cover these fields
+    claimed = Media.objects.filter(claimable([PENDING, FAILED]), pk=media_id).update(
+        processing_status=PROCESSING, updated_at=timezone.now())
+    if not claimed:
+        return False
+    media = Media.objects.get(pk=media_id)
+    if media.stored_object_id is not None:
+        processed = Media.objects.filter(
+            stored_object_id=media.stored_object_id, processing_status=DONE).exclude(pk=media_id).values(
+            'width', 'height', 'duration', 'derivatives').first()
+        if processed is not None:
+            Media.objects.filter(pk=media_id).update(
+                **processed, processing_status=DONE, updated_at=timezone.now())
+            return True
+    backend = get_object_storage()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'original')
+            with metrics.timed('gcs'):
+                backend.download(settings.GS_BUCKET_NAME, media_object_name(media.storage_file.name), path)
+            width, height, duration, derived = derive(media, path)
+
+        derivatives = {}
+        for size, data in derived.items():
+            name = derivative_name(media, size)
+            with metrics.timed('gcs'):
+                # Names change with the media or object only, derivatives never change
+                backend.upload(settings.GS_BUCKET_NAME, name, data, 'image/jpeg',
+                               cache_control='private, max-age=31536000, immutable')
+            derivatives[str(size)] = name
+    except Exception:
+        logger.exception('Media processing failed', extra={'media_id': media_id})
+        Media.objects.filter(pk=media_id).update(processing_status=FAILED, updated_at=timezone.now())
+        return False
+
+    # No save(), the timeline deltas of a media do not include these fields
+    Media.objects.filter(pk=media_id).update(
+        width=width, height=height, duration=duration, derivatives=derivatives,
+        processing_status=DONE, updated_at=timezone.now())
+    return True
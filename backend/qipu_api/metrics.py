@@ -0,0 +1,139 @@
+# metrics.py
+
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one request spent its time on, filled in while it runs."""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.timings = defaultdict(float)
+        # Signing threads of the batch endpoints report here too
+        self._lock = threading.Lock()
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.db_queries += 1
+                self.db_time += time.perf_counter() - started
+
+    def add_cache(self, hit):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] += seconds
+
+    def server_timing(self, wall):
+        """Value of the Server-Timing header, durations in milliseconds."""
+        entries = [
+            f'total;dur={wall * 1000:.2f}',
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_queries} queries"',
+            f'cache;desc="{self.cache_hits} hits {self.cache_misses} misses"',
+        ]
+        entries += [f'{name};dur={seconds * 1000:.2f}'
+                    for name, seconds in self.timings.items()]
+        return ', '.join(entries)
+
+
+def start():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_cache(hit)
+
+
+@contextmanager
+def timed(name):
+    """Adds the time spent in the block to the current request, if instrumented."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, time.perf_counter() - started)
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Nearest-rank percentiles of a list of numbers."""
+    if not values:
+        return {}
+    values = sorted(values)
+    return {f'p{point}': values[max(0, math.ceil(len(values) * point / 100) - 1)]
+            for point in points}
+
+
+class MetricsRegistry:
+    """
+    Recent samples per view, kept in bounded deques so memory stays flat.
+    Percentiles are computed when the snapshot is read, not on the request path.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, view, metrics, wall):
+        sample = (wall * 1000, metrics.db_queries, metrics.db_time * 1000,
+                  metrics.cache_hits, metrics.cache_misses,
+                  metrics.timings.get('gcs', 0.0) * 1000)
+        with self._lock:
+            if view not in self._samples:
+                self._samples[view] = deque(maxlen=self.max_samples)
+            self._samples[view].append(sample)
+            self._counts[view] += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {view: list(values) for view, values in self._samples.items()}
+            counts = dict(self._counts)
+        names = ('wall_ms', 'db_queries', 'db_ms', 'cache_hits', 'cache_misses', 'gcs_ms')
+        return {
+            view: {
+                'count': counts[view],
+                'samples': len(values),
+                **{name: percentiles([value[i] for value in values])
+                   for i, name in enumerate(names)},
+            }
+            for view, values in samples.items()
+        }
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+registry = MetricsRegistry()
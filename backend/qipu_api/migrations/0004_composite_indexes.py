@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qipu_api', '0003_posttag_mediatag'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'created_time'], name='event_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['user', 'created_time'], name='media_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediatag',
+            index=models.Index(fields=['tag', 'media'], name='mediatag_tag_media_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'created_time'], name='post_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['tag', 'post'], name='posttag_tag_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertag',
+            index=models.Index(fields=['content_type', 'object_id'], name='usertag_object_idx'),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# One statement-level trigger function per link table. Transition tables hold
+# every row of the statement, so bulk inserts and cascaded deletes cost one
+# grouped upsert/update instead of a round trip per link.
+TRIGGER_SQL = """
+CREATE FUNCTION {link}_usage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE qipu_api_tagusage u
+        SET {counter} = GREATEST(u.{counter} - d.count, 0)
+        FROM (
+            SELECT i.user_id, o.tag_id, count(*) AS count
+            FROM old_rows o JOIN {item} i ON i.id = o.{item_id}
+            GROUP BY i.user_id, o.tag_id
+        ) d
+        WHERE u.user_id = d.user_id AND u.tag_id = d.tag_id;
+
+        DELETE FROM qipu_api_tagusage u
+        WHERE u.post_count = 0 AND u.media_count = 0
+            AND (u.user_id, u.tag_id) IN (
+                SELECT i.user_id, o.tag_id
+                FROM old_rows o JOIN {item} i ON i.id = o.{item_id});
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO qipu_api_tagusage (user_id, tag_id, {counter}, {other})
+        SELECT i.user_id, n.tag_id, count(*), 0
+        FROM new_rows n JOIN {item} i ON i.id = n.{item_id}
+        GROUP BY i.user_id, n.tag_id
+        ON CONFLICT (user_id, tag_id)
+        DO UPDATE SET {counter} = qipu_api_tagusage.{counter} + EXCLUDED.{counter};
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER {link}_usage_insert AFTER INSERT ON {link}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {link}_usage();
+CREATE TRIGGER {link}_usage_update AFTER UPDATE ON {link}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {link}_usage();
+CREATE TRIGGER {link}_usage_delete AFTER DELETE ON {link}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {link}_usage();
+"""
+
+DROP_TRIGGER_SQL = "DROP FUNCTION {link}_usage() CASCADE;"
+
+LINKS = [
+    dict(link='qipu_api_posttag', item='qipu_api_post', item_id='post_id',
+         counter='post_count', other='media_count'),
+    dict(link='qipu_api_mediatag', item='qipu_api_media', item_id='media_id',
+         counter='media_count', other='post_count'),
+]
+
+BACKFILL_SQL = """
+INSERT INTO qipu_api_tagusage (user_id, tag_id, post_count, media_count)
+SELECT user_id, tag_id, sum(posts), sum(media) FROM (
+    SELECT p.user_id, pt.tag_id, count(*) AS posts, 0 AS media
+    FROM qipu_api_posttag pt JOIN qipu_api_post p ON p.id = pt.post_id
+    GROUP BY p.user_id, pt.tag_id
+    UNION ALL
+    SELECT m.user_id, mt.tag_id, 0, count(*)
+    FROM qipu_api_mediatag mt JOIN qipu_api_media m ON m.id = mt.media_id
+    GROUP BY m.user_id, mt.tag_id
+) counts
+GROUP BY user_id, tag_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qipu_api', '0005_tag_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('media_count', models.PositiveIntegerField(default=0)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='qipu_api.tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'tag')},
+            },
+        ),
+        *[migrations.RunSQL(TRIGGER_SQL.format(**link), DROP_TRIGGER_SQL.format(**link))
+          for link in LINKS],
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
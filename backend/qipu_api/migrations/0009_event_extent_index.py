@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:53
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+import qipu_api.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qipu_api', '0008_event_recurrence'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.AddIndex(
+            model_name='event',
+            index=django.contrib.postgres.indexes.GistIndex(models.F('user'), qipu_api.models.EventExtent(), name='event_user_extent_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+def drop_duplicates(apps, schema_editor):
+    # Concurrent invitations may have added some, keep the latest answer
+    Attendee = apps.get_model('qipu_api', 'Attendee')
+    pairs = Attendee.objects.order_by().values('event_id', 'user_id').annotate(
+        rows=models.Count('id')).filter(rows__gt=1)
+    for pair in pairs:
+        invitations = Attendee.objects.filter(event_id=pair['event_id'], user_id=pair['user_id'])
+        keep = invitations.order_by('-updated_at', '-pk').first()
+        invitations.exclude(pk=keep.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qipu_api', '0012_stored_object'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendee',
+            constraint=models.UniqueConstraint(fields=('event', 'user'), name='attendee_event_user_unique'),
+        ),
+    ]
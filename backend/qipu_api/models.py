@@ -1,8 +1,13 @@
 #models.py
 
 from django.db import models
+from django.contrib.postgres.fields import DateTimeRangeField
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
+from django.db.models.functions import Collate, Greatest, Upper
 from .utility import media_file_upload, validate_bio_length
+from .recurrence import series_end
 from datetime import datetime, timedelta
+import uuid
 from django.contrib.auth.models import AbstractUser
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -32,6 +37,7 @@ class User (AbstractUser):
 
 class Media (models.Model):
     created_time = models.DateTimeField(auto_now_add=True, blank=False)
+    updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -44,27 +50,99 @@ class Media (models.Model):
     storage_file = models.FileField(upload_to=media_file_upload, blank=False)
     is_published = models.BooleanField(default=False)
     category = models.IntegerField()
+    # Filled by media_processing: probed dimensions and duration, and the
+    # object names of the JPEG derivatives keyed by their longest edge
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    derivatives = models.JSONField(default=dict, blank=True)
+    PROCESSING_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    processing_status = models.CharField(
+        max_length=20, choices=PROCESSING_CHOICES, default='pending')
+    # Content-addressed object of an upload, shared with the media of the same bytes
+    stored_object = models.ForeignKey(
+        'StoredObject', null=True, blank=True, on_delete=models.PROTECT, related_name='media')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_time'],
+                         name='media_user_created_idx'),
+            # The backlog of the processing sweep, done rows are left out
+            models.Index(fields=['processing_status'], name='media_processing_idx',
+                         condition=~models.Q(processing_status='done')),
+        ]
 
 
 class Post (models.Model):
     created_time = models.DateTimeField(auto_now_add=True, blank=False)
+    updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE, blank=False
     )
     content = models.TextField(max_length=1000, blank=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_time'],
+                         name='post_user_created_idx'),
+        ]
+
+
+class EventExtent(models.Func):
+    """
+    tstzrange an event covers, [start_time, series_end] for a recurring one
+    (unbounded while the series has no end). Filter with alias(extent=
+    EventExtent()).filter(extent__overlap=...) to use event_user_extent_idx;
+    the bounds are inclusive, so recheck the exact times on the rows.
+    """
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+    def __init__(self):
+        end = models.Case(
+            models.When(rrule='', then=Greatest('start_time', 'end_time')),
+            default=models.F('series_end'))
+        super().__init__(models.F('start_time'), end, models.Value('[]'))
+
 
 class Event (models.Model):
     created_time = models.DateTimeField(auto_now_add=True, blank=False)
+    updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=100, blank=False)
     description = models.TextField(max_length=1000, blank=False)
     location = models.CharField(max_length=150, blank=False)
     start_time = models.DateTimeField(blank=False)
     end_time = models.DateTimeField()
+    # Set on an override or a cancellation of one occurrence of a series
     recurrence_id = models.ForeignKey(
         'self', null=True, blank=True, on_delete=models.CASCADE)
+    # RRULE of a series, e.g. FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10 (see recurrence.Rule)
+    rrule = models.CharField(max_length=500, blank=True, default='')
+    # End of the last occurrence, null for an endless series, kept by save()
+    series_end = models.DateTimeField(null=True, blank=True, editable=False)
+    # Start of the occurrence an override replaces
+    original_start = models.DateTimeField(null=True, blank=True)
+    is_cancelled = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_time'],
+                         name='event_user_created_idx'),
+            # Range lookups per user, btree_gist provides the user_id part
+            GistIndex(models.F('user'), EventExtent(),
+                      name='event_user_extent_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.series_end = series_end(self.rrule, self.start_time, self.end_time)
+        super().save(*args, **kwargs)
 
 
 class RelationshipLabel(models.Model):
@@ -117,12 +195,28 @@ class Attendee (models.Model):
     )
     status = models.CharField(
         max_length=50, choices=STATUS_CHOICES, blank=False, default='pending')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'user'], name='attendee_event_user_unique'),
+        ]
 
 
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Substring search (name__icontains) through pg_trgm
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'),
+                     name='tag_name_trgm_idx'),
+            # Case-insensitive prefix range scans, in byte order
+            models.Index(Collate(Upper('name'), 'C'),
+                         name='tag_name_prefix_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -137,6 +231,10 @@ class UserTag(models.Model):
 
     class Meta:
         unique_together = ['user', 'tag', 'content_type', 'object_id']
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'],
+                         name='usertag_object_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.tag.name} - {self.content_object}"
@@ -148,6 +246,10 @@ class PostTag(models.Model):
 
     class Meta:
         unique_together = ('post', 'tag')  # Ensure uniqueness
+        # Reverse of the unique index, for tag -> posts lookups
+        indexes = [
+            models.Index(fields=['tag', 'post'], name='posttag_tag_post_idx'),
+        ]
 
     def __str__(self):
         return f"{self.post} - {self.tag}"
@@ -159,6 +261,70 @@ class MediaTag(models.Model):
 
     class Meta:
         unique_together = ('media', 'tag')  # Ensure uniqueness
+        # Reverse of the unique index, for tag -> media lookups
+        indexes = [
+            models.Index(fields=['tag', 'media'], name='mediatag_tag_media_idx'),
+        ]
 
     def __str__(self):
         return f"{self.media} - {self.tag}"
+
+
+class TagUsage(models.Model):
+    """
+    How many of a user's posts and media carry a tag, so the tag sidebar and
+    search ranking read one row per tag instead of counting PostTag/MediaTag.
+
+    Kept up to date by the statement-level triggers of migration 0006 on
+    qipu_api_posttag and qipu_api_mediatag, which also see bulk_create,
+    queryset deletes and cascades. Rows that drop to zero are removed.
+    `manage.py rebuild_tag_usage` recomputes or checks the whole table.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='tag_usage')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    post_count = models.PositiveIntegerField(default=0)
+    media_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'tag')
+
+    def __str__(self):
+        return f"{self.user_id} - {self.tag_id}: {self.post_count} posts, {self.media_count} media"
+
+
+class UploadSession(models.Model):
+    """A resumable upload to the bucket, finalised into a Media once verified."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='upload_sessions')
+    object_name = models.CharField(max_length=255, unique=True)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    # Base64 MD5 of the whole file, as GCS reports md5Hash
+    md5_hash = models.CharField(max_length=24)
+    session_url = models.TextField()
+    media = models.OneToOneField(
+        Media, null=True, blank=True, on_delete=models.SET_NULL)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+
+class StoredObject(models.Model):
+    """
+    An uploaded object addressed by the SHA-256 of its bytes. A user's media of
+    the same content share it, ref_count counts them and the object is deleted
+    with the last one. Never shared across users.
+    """
+    # Left null with the user, their media drop the references
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    sha256 = models.CharField(max_length=64)
+    object_name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'sha256')
+
+    def __str__(self):
+        return self.object_name
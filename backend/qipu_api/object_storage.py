@@ -0,0 +1,429 @@
+# object_storage.py
+
+import base64
+import fcntl
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.parse import quote, unquote, urlencode, urlparse
+from django.conf import settings
+from django.utils._os import safe_join
+from django.utils.crypto import constant_time_compare, salted_hmac
+from google.cloud import storage
+from google.auth.credentials import AnonymousCredentials, with_scopes_if_required
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+
+ObjectInfo = namedtuple('ObjectInfo', ['size', 'md5_hash'])
+
+# GCS keeps a resumable upload session open for a week
+UPLOAD_SESSION_LIFETIME = timedelta(days=7)
+
+RANGE_PATTERN = re.compile(r'bytes=0-(\d+)')
+
+
+_storage_lock = threading.Lock()
+_storage_client = None
+_buckets = {}
+
+
+def _build_storage_client():
+    if settings.GS_EMULATOR_HOST:
+        # Local fake GCS server, no Google credentials involved
+        return storage.Client(
+            project=settings.GS_PROJECT_ID,
+            credentials=AnonymousCredentials(),
+            client_options={'api_endpoint': settings.GS_EMULATOR_HOST},
+        )
+    credentials = with_scopes_if_required(
+        settings.GS_CREDENTIALS, storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(
+        pool_connections=settings.GS_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.GS_HTTP_POOL_MAXSIZE,
+        max_retries=settings.GS_HTTP_MAX_RETRIES,
+    )
+    session.mount('https://', adapter)
+    return storage.Client(
+        project=settings.GS_PROJECT_ID, credentials=credentials, _http=session)
+
+
+def get_storage_client():
+    """
+    Returns the GCS client shared by the whole process, built on first use so
+    that forked workers never inherit each other's HTTP connections.
+    """
+    global _storage_client
+    if _storage_client is None:
+        with _storage_lock:
+            if _storage_client is None:
+                _storage_client = _build_storage_client()
+    return _storage_client
+
+
+def get_bucket(bucket_name):
+    """Returns the shared handle of a bucket. Creating it makes no API call."""
+    bucket = _buckets.get(bucket_name)
+    if bucket is None:
+        client = get_storage_client()
+        with _storage_lock:
+            bucket = _buckets.setdefault(bucket_name, client.bucket(bucket_name))
+    return bucket
+
+
+def reset_storage_client():
+    """Drops the shared client and bucket handles, e.g. after settings change in tests."""
+    global _storage_client
+    with _storage_lock:
+        _storage_client = None
+        _buckets.clear()
+
+
+class ObjectStorage:
+    """
+    The buckets media objects live in. Views, uploads and media processing
+    only go through this interface, OBJECT_STORAGE_BACKEND picks the
+    implementation.
+    """
+
+    def object_url(self, bucket_name, object_name):
+        """Unsigned URL of an object, as stored on Media rows."""
+        raise NotImplementedError
+
+    def sign_url(self, bucket_name, object_name, expiration, method='GET', content_type=None):
+        raise NotImplementedError
+
+    def open(self, bucket_name, object_name):
+        """Binary file of the object, read as it streams from the storage."""
+        raise NotImplementedError
+
+    def download(self, bucket_name, object_name, path):
+        raise NotImplementedError
+
+    def upload(self, bucket_name, object_name, data, content_type, cache_control=None):
+        raise NotImplementedError
+
+    def sha256(self, bucket_name, object_name):
+        """Hex SHA-256 of the object's bytes, none of the storages compute it for us."""
+        with self.open(bucket_name, object_name) as source:
+            return hashlib.file_digest(source, 'sha256').hexdigest()
+
+    def stat(self, bucket_name, object_name):
+        """ObjectInfo of an object (MD5 in base64, as GCS reports it), None if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, bucket_name, object_name):
+        raise NotImplementedError
+
+    def start_upload(self, bucket_name, object_name, content_type, size, origin=None):
+        """URL of a resumable upload session the client PUTs chunks to, with Content-Range."""
+        raise NotImplementedError
+
+    def received_bytes(self, session_url, size):
+        """Bytes of an upload session persisted so far, size once it is complete."""
+        raise NotImplementedError
+
+
+class GCSObjectStorage(ObjectStorage):
+    def object_url(self, bucket_name, object_name):
+        return f"https://storage.cloud.google.com/{bucket_name}/{quote(object_name, safe='/~')}"
+
+    def sign_url(self, bucket_name, object_name, expiration, method='GET', content_type=None):
+        blob = get_bucket(bucket_name).blob(object_name)
+        options = {}
+        if settings.GS_EMULATOR_HOST:
+            # The emulator client is anonymous, sign with the service account key
+            options['credentials'] = settings.GS_CREDENTIALS
+            options['api_access_endpoint'] = settings.GS_EMULATOR_HOST
+        return blob.generate_signed_url(
+            expiration=expiration, version='v4', method=method,
+            content_type=content_type, **options)
+
+    def open(self, bucket_name, object_name):
+        return get_bucket(bucket_name).blob(object_name).open('rb')
+
+    def download(self, bucket_name, object_name, path):
+        get_bucket(bucket_name).blob(object_name).download_to_filename(path)
+
+    def upload(self, bucket_name, object_name, data, content_type, cache_control=None):
+        blob = get_bucket(bucket_name).blob(object_name)
+        if cache_control:
+            blob.cache_control = cache_control
+        blob.upload_from_string(data, content_type=content_type)
+
+    def stat(self, bucket_name, object_name):
+        blob = get_bucket(bucket_name).get_blob(object_name)
+        return None if blob is None else ObjectInfo(blob.size, blob.md5_hash)
+
+    def delete(self, bucket_name, object_name):
+        get_bucket(bucket_name).blob(object_name).delete()
+
+    def start_upload(self, bucket_name, object_name, content_type, size, origin=None):
+        # The browser sends the chunks straight to GCS, origin is echoed in its CORS headers
+        return get_bucket(bucket_name).blob(object_name).create_resumable_upload_session(
+            content_type=content_type, size=size, origin=origin,
+            # Never replace an existing object
+            checksum=None, if_generation_match=0)
+
+    def received_bytes(self, session_url, size):
+        response = get_storage_client()._http.put(
+            session_url, headers={'Content-Range': f'bytes */{size}', 'Content-Length': '0'})
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code != 308:
+            response.raise_for_status()
+            raise RuntimeError(f'Unexpected status {response.status_code}')
+        match = RANGE_PATTERN.fullmatch(response.headers.get('Range', ''))
+        return int(match.group(1)) + 1 if match else 0
+
+
+def url_signature(method, bucket_name, object_name, content_type, expires):
+    message = '\n'.join([method, bucket_name, object_name, content_type or '', str(expires)])
+    return salted_hmac('qipu_api.object_storage', message,
+                       secret=settings.OBJECT_STORAGE_SIGNING_KEY, algorithm='sha256').hexdigest()
+
+
+def check_signature(method, bucket_name, object_name, query):
+    """Whether query holds an unexpired signature of the object for method."""
+    try:
+        expires = int(query.get('expires', ''))
+    except ValueError:
+        return False
+    expected = url_signature(method, bucket_name, object_name, query.get('content_type'), expires)
+    return expires > time.time() and constant_time_compare(expected, query.get('signature', ''))
+
+
+def upload_part_name(object_name):
+    return f'.uploads/{object_name}'
+
+
+def upload_lock_name(object_name):
+    return f'.uploads/{object_name}.lock'
+
+
+class HostedObjectStorage(ObjectStorage):
+    """
+    Objects kept by this deployment and served by ObjectStorageView, at
+    OBJECT_STORAGE_URL, through HMAC-signed URLs. Subclasses store the bytes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def upload_lock(self, bucket_name, object_name):
+        """
+        Serialises the chunks of one upload. They are sequential, this guards
+        a retried chunk racing the original. Only within this process here.
+        """
+        with self.lock:
+            yield
+
+    def size(self, bucket_name, object_name):
+        raise NotImplementedError
+
+    def write(self, bucket_name, object_name, chunks, append=False):
+        raise NotImplementedError
+
+    def remove(self, bucket_name, object_name):
+        raise NotImplementedError
+
+    def rename(self, bucket_name, source, target):
+        raise NotImplementedError
+
+    def object_url(self, bucket_name, object_name):
+        return f"{settings.OBJECT_STORAGE_URL.rstrip('/')}/{bucket_name}/{quote(object_name, safe='/~')}"
+
+    def parse_url(self, url):
+        """(bucket name, object name) of an object URL, signed or not."""
+        prefix = urlparse(settings.OBJECT_STORAGE_URL).path.rstrip('/') + '/'
+        path = unquote(urlparse(url).path)
+        if not path.startswith(prefix):
+            raise ValueError(f'Not an object URL: {url}')
+        bucket_name, _, object_name = path[len(prefix):].partition('/')
+        return bucket_name, object_name
+
+    def sign_url(self, bucket_name, object_name, expiration, method='GET', content_type=None):
+        expires = int(time.time() + expiration.total_seconds())
+        query = {'expires': expires}
+        if content_type:
+            query['content_type'] = content_type
+        query['signature'] = url_signature(method, bucket_name, object_name, content_type, expires)
+        return f'{self.object_url(bucket_name, object_name)}?{urlencode(query)}'
+
+    def download(self, bucket_name, object_name, path):
+        with self.open(bucket_name, object_name) as source, open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+    def upload(self, bucket_name, object_name, data, content_type, cache_control=None):
+        # Served with the content type of the name's extension, like every object here
+        self.write(bucket_name, object_name, [data])
+
+    def stat(self, bucket_name, object_name):
+        try:
+            source = self.open(bucket_name, object_name)
+        except FileNotFoundError:
+            return None
+        md5 = hashlib.md5()
+        size = 0
+        with source:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                md5.update(chunk)
+                size += len(chunk)
+        return ObjectInfo(size, base64.b64encode(md5.digest()).decode())
+
+    def delete(self, bucket_name, object_name):
+        self.remove(bucket_name, object_name)
+
+    def start_upload(self, bucket_name, object_name, content_type, size, origin=None):
+        self.remove(bucket_name, upload_part_name(object_name))
+        return self.sign_url(bucket_name, object_name, UPLOAD_SESSION_LIFETIME, method='PUT')
+
+    def received_bytes(self, session_url, size):
+        return self.received(*self.parse_url(session_url), size)
+
+    def received(self, bucket_name, object_name, size):
+        if self.size(bucket_name, object_name) is not None:
+            return size
+        return self.size(bucket_name, upload_part_name(object_name)) or 0
+
+    def write_chunk(self, bucket_name, object_name, first, chunks, size):
+        """
+        Appends the chunk starting at byte first of a resumable upload and
+        returns the bytes received. A chunk that does not continue the upload
+        is dropped, the client asks where to resume as it does with GCS.
+        FileExistsError if completing it would replace an object.
+        """
+        part = upload_part_name(object_name)
+        with self.upload_lock(bucket_name, object_name):
+            received = self.size(bucket_name, part) or 0
+            if first != received:
+                return received
+            self.write(bucket_name, part, chunks, append=True)
+            received = self.size(bucket_name, part)
+            if received >= size:
+                if self.size(bucket_name, object_name) is not None:
+                    raise FileExistsError(object_name)
+                self.rename(bucket_name, part, object_name)
+                # A chunk waiting on it finds no part left and asks where to resume
+                self.remove(bucket_name, upload_lock_name(object_name))
+        return received
+
+
+class FileSystemObjectStorage(HostedObjectStorage):
+    """Objects as files under OBJECT_STORAGE_ROOT/<bucket>/, e.g. for an on-prem deployment."""
+
+    def path(self, bucket_name, object_name):
+        # Raises SuspiciousFileOperation on names escaping the bucket
+        return safe_join(settings.OBJECT_STORAGE_ROOT, bucket_name, object_name)
+
+    def open(self, bucket_name, object_name):
+        return open(self.path(bucket_name, object_name), 'rb')
+
+    @contextmanager
+    def upload_lock(self, bucket_name, object_name):
+        # Several worker processes may receive chunks of the same upload
+        path = self.path(bucket_name, upload_lock_name(object_name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as lock:
+            # Released when the file closes
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def size(self, bucket_name, object_name):
+        try:
+            return os.path.getsize(self.path(bucket_name, object_name))
+        except FileNotFoundError:
+            return None
+
+    def write(self, bucket_name, object_name, chunks, append=False):
+        path = self.path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if append:
+            with open(path, 'ab') as target:
+                for chunk in chunks:
+                    target.write(chunk)
+            return
+        # Readers never see a half-written object, each writer has its own file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path),
+                                         suffix='.tmp', delete=False) as target:
+            try:
+                for chunk in chunks:
+                    target.write(chunk)
+            except BaseException:
+                target.close()
+                os.remove(target.name)
+                raise
+        os.replace(target.name, path)
+
+    def remove(self, bucket_name, object_name):
+        try:
+            os.remove(self.path(bucket_name, object_name))
+        except FileNotFoundError:
+            pass
+
+    def rename(self, bucket_name, source, target):
+        target = self.path(bucket_name, target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self.path(bucket_name, source), target)
+
+
+class MemoryObjectStorage(HostedObjectStorage):
+    """Objects in this process's memory, for tests and offline load tests."""
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+
+    def open(self, bucket_name, object_name):
+        try:
+            return io.BytesIO(self.objects[bucket_name, object_name])
+        except KeyError:
+            raise FileNotFoundError(object_name)
+
+    def size(self, bucket_name, object_name):
+        data = self.objects.get((bucket_name, object_name))
+        return None if data is None else len(data)
+
+    def write(self, bucket_name, object_name, chunks, append=False):
+        data = b''.join(chunks)
+        if append:
+            data = self.objects.get((bucket_name, object_name), b'') + data
+        self.objects[bucket_name, object_name] = data
+
+    def remove(self, bucket_name, object_name):
+        self.objects.pop((bucket_name, object_name), None)
+
+    def rename(self, bucket_name, source, target):
+        self.objects[bucket_name, target] = self.objects.pop((bucket_name, source))
+
+    def clear(self):
+        self.objects.clear()
+
+
+BACKENDS = {
+    'gcs': GCSObjectStorage,
+    'filesystem': FileSystemObjectStorage,
+    'memory': MemoryObjectStorage,
+}
+
+_backends = {}
+
+
+def get_object_storage():
+    """The OBJECT_STORAGE_BACKEND instance shared by the process."""
+    name = settings.OBJECT_STORAGE_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        with _storage_lock:
+            backend = _backends.setdefault(name, BACKENDS[name]())
+    return backend
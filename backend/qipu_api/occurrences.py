@@ -0,0 +1,75 @@
+# occurrences.py
+
+from collections import defaultdict, namedtuple
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from .models import EventExtent
+from .recurrence import occurrence_starts
+
+
+# occurrence_start is set on the occurrences generated from a series only
+Occurrence = namedtuple('Occurrence', 'start end event occurrence_start')
+
+
+def overlapping(events, start, end):
+    """Events whose extent overlaps [start, end), read through event_user_extent_idx."""
+    return events.alias(extent=EventExtent()).filter(
+        extent__overlap=DateTimeTZRange(start, end, '[)'))
+
+
+def occurrences(events, start, end):
+    """
+    Occurrences overlapping [start, end) sorted by start: plain events, the
+    expansion of recurring series, and overrides in place of the occurrences
+    they replace. Cancelled occurrences are left out.
+    """
+    rows = list(overlapping(events, start, end))
+    series = [event for event in rows if event.rrule]
+    overrides = [event for event in rows if event.recurrence_id_id is not None]
+    if series:
+        # An override moved out of the window still replaces its occurrence
+        longest = max(event.end_time - event.start_time for event in series)
+        overrides += events.filter(
+            recurrence_id__in=series, original_start__gte=start - longest,
+            original_start__lt=end)
+    replaced = {(event.recurrence_id_id, event.original_start) for event in overrides}
+
+    result = [
+        Occurrence(event.start_time, event.end_time, event, None)
+        for event in rows
+        if not event.rrule and not event.is_cancelled
+        and event.start_time < end and event.end_time > start
+    ]
+    starts = occurrence_starts(series, start, end)
+    for event in series:
+        duration = event.end_time - event.start_time
+        result += [
+            Occurrence(occurrence, occurrence + duration, event, occurrence)
+            for occurrence in starts[event.pk]
+            if (event.pk, occurrence) not in replaced
+        ]
+    result.sort(key=lambda occurrence: occurrence.start)
+    return result
+
+
+def busy_intervals(events, start, end):
+    """Occurrences in [start, end) merged into disjoint [start, end] pairs, clipped to the window."""
+    return merge_busy(occurrences(events, start, end), start, end)
+
+
+def busy_intervals_by_user(events, start, end):
+    """busy_intervals of each user with events, all of them read at once."""
+    by_user = defaultdict(list)
+    for occurrence in occurrences(events, start, end):
+        by_user[occurrence.event.user_id].append(occurrence)
+    return {user_id: merge_busy(items, start, end) for user_id, items in by_user.items()}
+
+
+def merge_busy(occurrences, start, end):
+    busy = []
+    for occurrence in occurrences:
+        lower, upper = max(occurrence.start, start), min(occurrence.end, end)
+        if busy and lower <= busy[-1][1]:
+            busy[-1][1] = max(busy[-1][1], upper)
+        else:
+            busy.append([lower, upper])
+    return busy
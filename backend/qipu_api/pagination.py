@@ -0,0 +1,127 @@
+# pagination.py
+
+import base64
+import json
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CreatedTimeCursorPagination(BasePagination):
+    """
+    Keyset pagination on (created_time, id), newest first.
+
+    The cursor stores the (created_time, id) of the row the page stops at
+    instead of an offset, so rows inserted concurrently never shift or repeat
+    items of the following pages, and every page is a single index range scan
+    whatever the size of the account.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = settings.API_PAGE_SIZE
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(
+                    request.query_params[self.page_size_query_param])
+            except ValueError:
+                pass
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, obj, reverse):
+        position = {
+            't': obj.created_time.isoformat(),
+            'i': obj.pk,
+            'r': int(reverse),
+        }
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(position, separators=(',', ':')).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            created_time = parse_datetime(position['t'])
+            pk = int(position['i'])
+            reverse = bool(position.get('r', 0))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_time is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_time, pk, reverse
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        reverse = False
+        if position is None:
+            queryset = queryset.order_by('-created_time', '-id')
+        else:
+            created_time, pk, reverse = position
+            if reverse:
+                # Walking back towards newer rows, flipped again below
+                queryset = queryset.filter(
+                    Q(created_time__gt=created_time) |
+                    Q(created_time=created_time, id__gt=pk)
+                ).order_by('created_time', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(created_time__lt=created_time) |
+                    Q(created_time=created_time, id__lt=pk)
+                ).order_by('-created_time', '-id')
+
+        # One extra row tells whether there is anything past this page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,6 +1,54 @@
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import BooleanField, F, Func, Q
+from django.db.models.constants import LOOKUP_SEP
 from rest_framework import permissions
 from rest_framework.permissions import IsAuthenticated
-from .models import User, Contact, Attendee, Media, Post, Event, RelationshipLabel, UserTag
+from .models import User, Contact, Attendee, Media, Post, Event, RelationshipLabel, UserTag, UploadSession
+
+
+# Rows a user may read, per model: a row is visible when any of the lookups
+# equals the user. Models not listed (tags, labels) are shared by everyone.
+OWNERSHIP_RULES = {
+    User: ('pk', 'outgoing_requests__recipient', 'incoming_requests__requester'),
+    Media: ('user',),
+    Post: ('user',),
+    Event: ('user', 'attendee__user'),
+    Contact: ('requester', 'recipient'),
+    Attendee: ('user', 'event__user'),
+    UserTag: ('user',),
+    UploadSession: ('user',),
+}
+
+
+class EqualsAny(Func):
+    """
+    pk = ANY(ARRAY(subquery)). The subquery runs once up front, so OR'ed with
+    other conditions the outer scan is still a BitmapOr of index scans, where
+    pk IN (subquery) or a join falls back to a sequential scan.
+    """
+    arg_joiner = ' = ANY('
+    template = '(%(expressions)s))'
+    output_field = BooleanField()
+
+
+def owned_by(queryset, user):
+    """
+    queryset restricted to the rows user may read, following OWNERSHIP_RULES.
+    Lookups through relations become subqueries, so rows are never duplicated
+    and each branch is an index scan on its own foreign key.
+    """
+    lookups = OWNERSHIP_RULES.get(queryset.model)
+    if lookups is None:
+        return queryset
+    model = queryset.model
+    condition = Q()
+    for lookup in lookups:
+        if LOOKUP_SEP in lookup:
+            condition |= Q(EqualsAny(F('pk'), ArraySubquery(
+                model._base_manager.filter(**{lookup: user.pk}).values('pk'))))
+        else:
+            condition |= Q(**{lookup: user.pk})
+    return queryset.filter(condition)
 
 
 class IsOwner(permissions.BasePermission):
@@ -36,8 +84,9 @@ class IsOwnerOrInvolved(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # Check if the requesting user is either the event creator or the attendee
+        # Ids only, the event comes with select_related('event') or not at all
         if isinstance(obj, Attendee):
-            return obj.event.user == request.user or obj.user == request.user
+            return request.user.pk in (obj.event.user_id, obj.user_id)
 
         # Check if the requesting user is either the requester or the recipient
         if isinstance(obj, Contact):
@@ -48,9 +97,13 @@ class IsOwnerOrInvolved(permissions.BasePermission):
 
 class PermissionMixin(object):
     """
-    Defines permission classes based on the action type.
+    Defines permission classes based on the action type, and scopes the
+    queryset to the rows the user may read (see owned_by).
     """
 
+    def get_queryset(self):
+        return owned_by(super().get_queryset(), self.request.user)
+
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             self.permission_classes = [IsAuthenticated, IsOwner]
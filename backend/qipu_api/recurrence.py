@@ -0,0 +1,288 @@
+# recurrence.py
+
+import calendar
+from datetime import datetime, time, timedelta, timezone
+from django.conf import settings
+from django.core.cache import cache
+
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+# Occurrences returned for one series in one window
+MAX_OCCURRENCES = 5000
+
+# Largest COUNT accepted, ten thousand days is over 27 years
+MAX_COUNT = 10000
+
+# Periods in a row without any occurrence before a rule is considered empty,
+# e.g. FREQ=DAILY;INTERVAL=7;BYDAY=TU starting on a Monday
+MAX_EMPTY_PERIODS = 1000
+
+
+class Rule:
+    """
+    The RFC 5545 RRULE subset Events support: FREQ (DAILY, WEEKLY, MONTHLY,
+    YEARLY), INTERVAL, COUNT or UNTIL, BYDAY (weekday codes, DAILY/WEEKLY) and
+    BYMONTHDAY (MONTHLY). Occurrences keep the UTC time of day of DTSTART.
+    """
+
+    def __init__(self, freq, interval=1, count=None, until=None, byday=(), bymonthday=()):
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = sorted(set(byday))
+        self.bymonthday = sorted(set(bymonthday))
+
+    @classmethod
+    def parse(cls, text):
+        """Parses 'FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10', raises ValueError."""
+        if text.upper().startswith('RRULE:'):
+            text = text[6:]
+        parts = {}
+        for part in filter(None, text.strip().split(';')):
+            name, sep, value = part.partition('=')
+            if not sep or not value:
+                raise ValueError(f"Invalid rule part: {part}")
+            parts[name.upper()] = value.upper()
+
+        freq = parts.pop('FREQ', None)
+        if freq not in FREQUENCIES:
+            raise ValueError(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+        options = {}
+        try:
+            if 'INTERVAL' in parts:
+                options['interval'] = int(parts.pop('INTERVAL'))
+                if options['interval'] < 1:
+                    raise ValueError
+            if 'COUNT' in parts:
+                options['count'] = int(parts.pop('COUNT'))
+                if options['count'] < 1:
+                    raise ValueError
+            if 'UNTIL' in parts:
+                options['until'] = parse_until(parts.pop('UNTIL'))
+            if 'BYDAY' in parts:
+                options['byday'] = [WEEKDAYS.index(day) for day in parts.pop('BYDAY').split(',')]
+            if 'BYMONTHDAY' in parts:
+                options['bymonthday'] = [int(day) for day in parts.pop('BYMONTHDAY').split(',')]
+        except ValueError:
+            raise ValueError(f"Invalid value in rule: {text}")
+        parts.pop('WKST', None)
+        if parts:
+            raise ValueError(f"Unsupported rule parts: {', '.join(sorted(parts))}")
+        if options.get('count', 0) > MAX_COUNT:
+            raise ValueError(f"COUNT cannot exceed {MAX_COUNT}")
+        if 'count' in options and 'until' in options:
+            raise ValueError("COUNT and UNTIL cannot be combined")
+        if options.get('byday') and freq not in ('DAILY', 'WEEKLY'):
+            raise ValueError("BYDAY is supported with DAILY and WEEKLY only")
+        if options.get('bymonthday') and (freq != 'MONTHLY' or not all(
+                1 <= day <= 31 for day in options['bymonthday'])):
+            raise ValueError("BYMONTHDAY must be days 1-31 of a MONTHLY rule")
+        return cls(freq, **options)
+
+
+def parse_until(value):
+    for pattern in ('%Y%m%dT%H%M%SZ', '%Y%m%dT%H%M%S', '%Y%m%d'):
+        try:
+            until = datetime.strptime(value, pattern)
+        except ValueError:
+            continue
+        if pattern == '%Y%m%d':
+            # A date UNTIL includes the whole day
+            until = datetime.combine(until.date(), time.max)
+        return until.replace(tzinfo=timezone.utc)
+    raise ValueError(value)
+
+
+def month_index(moment):
+    return moment.year * 12 + moment.month - 1
+
+
+class Recurrence:
+    """
+    Occurrence starts of a rule anchored at dtstart, generated period by
+    period (one day, week, month or year times INTERVAL). The first period
+    touching a window is computed directly, and so is the number of
+    occurrences before it when every period holds as many, so expanding a
+    window costs the same at the start of the series and ten years into it.
+    """
+
+    def __init__(self, rule, dtstart):
+        self.rule = rule
+        self.dtstart = dtstart.astimezone(timezone.utc)
+        self.clock = self.dtstart.timetz()
+        if rule.freq == 'WEEKLY':
+            self.base = self.dtstart - timedelta(days=self.dtstart.weekday())
+            self.weekdays = rule.byday or [self.dtstart.weekday()]
+
+    def period(self, k):
+        """Sorted starts of the k-th period, those before dtstart left out."""
+        rule, dtstart = self.rule, self.dtstart
+        if rule.freq == 'DAILY':
+            starts = [dtstart + timedelta(days=k * rule.interval)]
+            if rule.byday:
+                starts = [start for start in starts if start.weekday() in rule.byday]
+        elif rule.freq == 'WEEKLY':
+            week = self.base + timedelta(weeks=k * rule.interval)
+            starts = [week + timedelta(days=day) for day in self.weekdays]
+        elif rule.freq == 'MONTHLY':
+            year, month = divmod(month_index(dtstart) + k * rule.interval, 12)
+            starts = self.on_days(year, month + 1, rule.bymonthday or [dtstart.day])
+        else:
+            starts = self.on_days(dtstart.year + k * rule.interval, dtstart.month, [dtstart.day])
+        return [start for start in starts if start >= dtstart]
+
+    def period_start(self, k):
+        """Lower bound of the starts of the k-th period."""
+        rule = self.rule
+        if rule.freq == 'DAILY':
+            return self.dtstart + timedelta(days=k * rule.interval)
+        if rule.freq == 'WEEKLY':
+            return self.base + timedelta(weeks=k * rule.interval)
+        if rule.freq == 'MONTHLY':
+            year, month = divmod(month_index(self.dtstart) + k * rule.interval, 12)
+            return datetime(year, month + 1, 1, tzinfo=timezone.utc)
+        return datetime(self.dtstart.year + k * rule.interval, 1, 1, tzinfo=timezone.utc)
+
+    def period_size(self):
+        """
+        Occurrences of every period after the first, None when it varies with
+        the weekday, the length of the month or leap years.
+        """
+        rule = self.rule
+        if rule.freq == 'DAILY':
+            return None if rule.byday else 1
+        if rule.freq == 'WEEKLY':
+            return len(self.weekdays)
+        if rule.freq == 'MONTHLY':
+            days = rule.bymonthday or [self.dtstart.day]
+            return len(days) if max(days) <= 28 else None
+        return None if (self.dtstart.month, self.dtstart.day) == (2, 29) else 1
+
+    def count_before(self, k):
+        """Occurrences in the periods before the k-th, COUNT aside. None unless period_size is fixed."""
+        size = self.period_size()
+        if size is None:
+            return None
+        return 0 if k == 0 else len(self.period(0)) + (k - 1) * size
+
+    def on_days(self, year, month, days):
+        # Days the month does not have are skipped, as RFC 5545 does
+        last = calendar.monthrange(year, month)[1]
+        return [datetime.combine(datetime(year, month, day).date(), self.clock)
+                for day in days if day <= last]
+
+    def first_period(self, moment):
+        """Index of the period containing moment, so earlier ones end before it."""
+        rule = self.rule
+        if moment <= self.dtstart:
+            return 0
+        if rule.freq == 'DAILY':
+            return (moment - self.dtstart).days // rule.interval
+        if rule.freq == 'WEEKLY':
+            return (moment - self.base).days // (7 * rule.interval)
+        if rule.freq == 'MONTHLY':
+            return (month_index(moment) - month_index(self.dtstart)) // rule.interval
+        return (moment.year - self.dtstart.year) // rule.interval
+
+    def iterate(self, first=0, stop=None, emitted=0):
+        """
+        Yields the starts from period `first` on, up to UNTIL, COUNT or stop.
+        emitted is the number of occurrences before that period.
+        """
+        rule = self.rule
+        k, empty = first, 0
+        while stop is None or self.period_start(k) < stop:
+            starts = self.period(k)
+            empty = 0 if starts else empty + 1
+            if empty > MAX_EMPTY_PERIODS:
+                return
+            for start in starts:
+                if rule.until is not None and start > rule.until:
+                    return
+                if rule.count is not None and emitted >= rule.count:
+                    return
+                emitted += 1
+                yield start
+            k += 1
+
+    def between(self, start, end, duration):
+        """Starts of the occurrences overlapping [start, end)."""
+        start, end = start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+        lower = start - duration
+        first, emitted = self.first_period(lower), 0
+        if self.rule.count is not None:
+            # COUNT depends on everything before the window
+            emitted = self.count_before(first)
+            if emitted is None:
+                # Walk from the start, MAX_COUNT bounds it
+                first, emitted = 0, 0
+        occurrences = []
+        for occurrence in self.iterate(first, stop=end, emitted=emitted):
+            if occurrence >= end or len(occurrences) >= MAX_OCCURRENCES:
+                break
+            if occurrence + duration > start:
+                occurrences.append(occurrence)
+        return occurrences
+
+    def last(self):
+        """
+        Start of the last occurrence, None for a series without end. Raises
+        ValueError when it would fall after the year 9999.
+        """
+        rule = self.rule
+        if rule.until is not None:
+            # An upper bound is enough for range queries, no need to walk the series
+            return rule.until
+        if rule.count is None:
+            return None
+        try:
+            size = self.period_size()
+            if size is None:
+                last = None
+                for last in self.iterate():
+                    pass
+                return last
+            first = self.period(0)
+            if rule.count <= len(first):
+                return first[rule.count - 1]
+            k, index = divmod(rule.count - len(first) - 1, size)
+            return self.period(k + 1)[index]
+        except (OverflowError, ValueError):
+            raise ValueError("The series would end after the year 9999")
+
+
+def series_end(rrule, start_time, end_time):
+    """Upper bound of the end of the last occurrence, None if unbounded."""
+    if not rrule:
+        return None
+    last = Recurrence(Rule.parse(rrule), start_time).last()
+    if last is None:
+        return None
+    # An UNTIL before DTSTART leaves the series empty, keep it a valid range
+    return max(last, start_time) + (end_time - start_time)
+
+
+def occurrence_starts(series, start, end):
+    """
+    {event id: occurrence starts in [start, end)} for recurring events. The
+    expansion of each window is cached, keyed on the event's updated_at so
+    any edit of the series starts a new entry.
+    """
+    keys = {
+        f'occurrences:{event.pk}:{event.updated_at.timestamp()}:'
+        f'{start.timestamp()}:{end.timestamp()}': event
+        for event in series
+    }
+    cached = cache.get_many(list(keys))
+    missing = {}
+    for key, event in keys.items():
+        if key not in cached:
+            missing[key] = Recurrence(Rule.parse(event.rrule), event.start_time).between(
+                start, end, event.end_time - event.start_time)
+    if missing:
+        cache.set_many(missing, settings.RECURRENCE_CACHE_TIMEOUT)
+    cached.update(missing)
+    return {event.pk: cached[key] for key, event in keys.items()}
@@ -1,6 +1,10 @@
+import base64
+from django.conf import settings
 from rest_framework import serializers
+from .recurrence import Rule, series_end
 # Note the changes here
-from .models import User, Media, Post, Event, Contact, Attendee, Unique, RelationshipLabel, Tag, UserTag
+from .models import (User, Media, Post, Event, Contact, Attendee, Unique, RelationshipLabel, Tag, UserTag, TagUsage,
+                     UploadSession)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -27,10 +31,11 @@ class MediaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Media
         fields = '__all__'  # Includes all fields from the Media model, plus the tagIds we're adding
+        read_only_fields = ['width', 'height', 'duration', 'derivatives', 'processing_status', 'stored_object']
 
     def get_tagIds(self, obj):
-        # Get all MediaTag instances related to this media and return their tag IDs
-        return list(obj.mediatag_set.all().values_list('tag__id', flat=True))
+        # Reads the prefetched MediaTag rows when the view provides them
+        return [media_tag.tag_id for media_tag in obj.mediatag_set.all()]
 
 
 class PostSerializer(serializers.ModelSerializer):
@@ -41,8 +46,8 @@ class PostSerializer(serializers.ModelSerializer):
         fields = '__all__'  # Includes all fields from the Post model, plus the tagIds we're adding
 
     def get_tagIds(self, obj):
-        # Get all PostTag instances related to this post and return their tag IDs
-        return list(obj.posttag_set.all().values_list('tag__id', flat=True))
+        # Reads the prefetched PostTag rows when the view provides them
+        return [post_tag.tag_id for post_tag in obj.posttag_set.all()]
 
 
 class EventSerializer(serializers.ModelSerializer):
@@ -50,6 +55,31 @@ class EventSerializer(serializers.ModelSerializer):
         model = Event
         fields = '__all__'
 
+    def validate(self, data):
+        data = super().validate(data)
+
+        def get(name):
+            return data.get(name, getattr(self.instance, name, None))
+
+        if get('rrule'):
+            try:
+                Rule.parse(get('rrule'))
+                if get('start_time') and get('end_time'):
+                    # Rejects a series running past the year 9999
+                    series_end(get('rrule'), get('start_time'), get('end_time'))
+            except ValueError as e:
+                raise serializers.ValidationError({'rrule': str(e)})
+            if get('recurrence_id'):
+                raise serializers.ValidationError(
+                    {'rrule': 'An override cannot have its own rule'})
+        if get('recurrence_id') and not get('original_start'):
+            raise serializers.ValidationError(
+                {'original_start': 'Required on an override'})
+        if get('start_time') and get('end_time') and get('end_time') < get('start_time'):
+            raise serializers.ValidationError(
+                {'end_time': 'Must not be before start_time'})
+        return data
+
 
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
@@ -63,6 +93,45 @@ class AttendeeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class InvitationSerializer(serializers.Serializer):
+    event = serializers.IntegerField()
+    user = serializers.IntegerField()
+
+
+class RSVPSerializer(serializers.Serializer):
+    attendee = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=Attendee.STATUS_CHOICES)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    filename = serializers.CharField(write_only=True, max_length=200)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'object_name', 'content_type', 'size', 'md5_hash',
+                  'session_url', 'media', 'created_time']
+        read_only_fields = ['object_name', 'session_url', 'media']
+
+    def validate_content_type(self, value):
+        if not value.startswith(settings.UPLOAD_CONTENT_TYPES):
+            raise serializers.ValidationError('Only images and videos can be uploaded')
+        return value
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes')
+        return value
+
+    def validate_md5_hash(self, value):
+        try:
+            digest = base64.b64decode(value, validate=True)
+        except ValueError:
+            digest = b''
+        if len(digest) != 16:
+            raise serializers.ValidationError('Expected the base64 MD5 of the file')
+        return value
+
+
 class UniqueSerializer(serializers.ModelSerializer):
     class Meta:
         model = Unique
@@ -81,6 +150,14 @@ class TagSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class TagUsageSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='tag.name', read_only=True)
+
+    class Meta:
+        model = TagUsage
+        fields = ['tag', 'name', 'post_count', 'media_count']
+
+
 class PasswordResetRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
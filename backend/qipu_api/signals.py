@@ -0,0 +1,204 @@
+# signals.py
+
+import logging
+from collections import defaultdict
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from .models import User, Post, Media, Event, Tag, PostTag, MediaTag, Contact, RelationshipLabel
+from .authentication import user_cache
+from . import tag_cache, contact_graph, media_processing, stored_objects
+
+
+logger = logging.getLogger(__name__)
+
+CREATED, UPDATED, DELETED = 'created', 'updated', 'deleted'
+
+# Deltas per channel layer message, keeps big imports under the frame limits
+DELTAS_PER_MESSAGE = 500
+
+
+def timeline_group(user_id):
+    return f'timeline_{user_id}'
+
+
+def isoformat(value):
+    # Channel layer messages are msgpack, which has no datetime type
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def item_delta(op, obj, tag_ids=None):
+    """The few fields the Dashboard needs to place an item on its timelines."""
+    delta = {'op': op, 'type': type(obj).__name__.lower(), 'id': obj.pk}
+    if op == DELETED:
+        return delta
+    delta['created_time'] = isoformat(obj.created_time)
+    if isinstance(obj, Post):
+        delta['content'] = obj.content
+    elif isinstance(obj, Media):
+        delta['caption'] = obj.caption
+        delta['media_type'] = obj.media_type
+    else:
+        delta['title'] = obj.title
+        delta['location'] = obj.location
+        delta['start_time'] = isoformat(obj.start_time)
+        delta['end_time'] = isoformat(obj.end_time)
+    if not isinstance(obj, Event):
+        delta['tagIds'] = tag_ids or []
+    return delta
+
+
+def item_deltas(op, objects):
+    """Deltas for several items, with one tag query per model."""
+    tag_ids = defaultdict(list)
+    post_ids = [obj.pk for obj in objects if isinstance(obj, Post)]
+    media_ids = [obj.pk for obj in objects if isinstance(obj, Media)]
+    if post_ids:
+        for post_id, tag_id in PostTag.objects.filter(
+                post_id__in=post_ids).values_list('post_id', 'tag_id'):
+            tag_ids[Post, post_id].append(tag_id)
+    if media_ids:
+        for media_id, tag_id in MediaTag.objects.filter(
+                media_id__in=media_ids).values_list('media_id', 'tag_id'):
+            tag_ids[Media, media_id].append(tag_id)
+    return [item_delta(op, obj, tag_ids[type(obj), obj.pk]) for obj in objects]
+
+
+def publish(user_id, deltas):
+    """
+    Sends deltas to the user's timeline group. A missing or unreachable
+    channel layer is logged, it never fails the write that caused the deltas.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not deltas:
+        return
+    try:
+        for start in range(0, len(deltas), DELTAS_PER_MESSAGE):
+            async_to_sync(channel_layer.group_send)(timeline_group(user_id), {
+                'type': 'timeline.delta',
+                'deltas': deltas[start:start + DELTAS_PER_MESSAGE],
+            })
+    except Exception:
+        logger.warning('Could not push timeline deltas', exc_info=True,
+                       extra={'user_id': user_id, 'count': len(deltas)})
+
+
+def publish_on_commit(op, objects):
+    """
+    Pushes deltas for the objects once the current transaction commits, so
+    clients never see rows that get rolled back. Created and updated items are
+    read at commit time, after their tag links were written.
+    """
+    objects = list(objects)
+    deleted = [item_delta(op, obj) for obj in objects] if op == DELETED else None
+
+    def send():
+        deltas = deleted if deleted is not None else item_deltas(op, objects)
+        by_user = defaultdict(list)
+        for obj, delta in zip(objects, deltas):
+            by_user[obj.user_id].append(delta)
+        for user_id, user_deltas in by_user.items():
+            publish(user_id, user_deltas)
+
+    transaction.on_commit(send)
+
+
+def item_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        publish_on_commit(CREATED if created else UPDATED, [instance])
+
+
+def media_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        media_processing.enqueue([instance.pk])
+
+
+def media_deleted(sender, instance, **kwargs):
+    # Also sent for the media deleted in cascade, e.g. with their user
+    derived = list(instance.derivatives.values())
+    if instance.stored_object_id is not None:
+        stored_objects.release(instance.stored_object_id, derived)
+    else:
+        for name in derived:
+            stored_objects.delete_on_commit(settings.GS_BUCKET_NAME, name)
+
+
+def item_deleted(sender, instance, **kwargs):
+    publish_on_commit(DELETED, [instance])
+
+
+def tag_changed(sender, instance, **kwargs):
+    tag_cache.invalidate(tag_cache.CATALOGUE)
+
+
+def tagged_item_deleted(sender, instance, **kwargs):
+    # Covers the links deleted along with the item
+    tag_cache.invalidate(tag_cache.user_tags(instance.user_id))
+
+
+def link_changed(sender, instance, origin=None, **kwargs):
+    if origin is not None:
+        origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+        if origin_model is not sender:
+            # Cascade from an item or a tag, their own handlers invalidate
+            return
+    item = instance.post if isinstance(instance, PostTag) else instance.media
+    tag_cache.invalidate(tag_cache.user_tags(item.user_id))
+
+
+def contact_changed(sender, instance, **kwargs):
+    contact_graph.invalidate(instance.requester_id, instance.recipient_id)
+
+
+def contact_labels_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Labelled from the label side, any user may be involved
+        contact_graph.invalidate_labels()
+    else:
+        contact_graph.invalidate(instance.requester_id, instance.recipient_id)
+
+
+def label_changed(sender, instance, **kwargs):
+    contact_graph.invalidate_labels()
+
+
+def user_changed(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+
+def connect():
+    # bulk_create sends no signals, create_items publishes its items itself
+    for model in (Post, Media, Event):
+        post_save.connect(item_saved, sender=model,
+                          dispatch_uid=f'timeline_saved_{model.__name__}')
+        post_delete.connect(item_deleted, sender=model,
+                            dispatch_uid=f'timeline_deleted_{model.__name__}')
+
+    post_save.connect(tag_changed, sender=Tag, dispatch_uid='tag_cache_tag_saved')
+    post_delete.connect(tag_changed, sender=Tag, dispatch_uid='tag_cache_tag_deleted')
+    for model in (Post, Media):
+        post_delete.connect(tagged_item_deleted, sender=model,
+                            dispatch_uid=f'tag_cache_deleted_{model.__name__}')
+    for model in (PostTag, MediaTag):
+        post_save.connect(link_changed, sender=model,
+                          dispatch_uid=f'tag_cache_saved_{model.__name__}')
+        post_delete.connect(link_changed, sender=model,
+                            dispatch_uid=f'tag_cache_deleted_{model.__name__}')
+
+    post_save.connect(contact_changed, sender=Contact, dispatch_uid='contact_graph_saved')
+    post_delete.connect(contact_changed, sender=Contact, dispatch_uid='contact_graph_deleted')
+    m2m_changed.connect(contact_labels_changed, sender=Contact.labels.through,
+                        dispatch_uid='contact_graph_labels')
+    post_delete.connect(label_changed, sender=RelationshipLabel, dispatch_uid='contact_graph_label_deleted')
+
+    # bulk_create sends no signals, create_items queues its media itself
+    post_save.connect(media_created, sender=Media, dispatch_uid='media_processing_created')
+    post_delete.connect(media_deleted, sender=Media, dispatch_uid='stored_objects_media_deleted')
+
+    post_save.connect(user_changed, sender=User, dispatch_uid='user_cache_saved')
+    post_delete.connect(user_changed, sender=User, dispatch_uid='user_cache_deleted')
@@ -0,0 +1,70 @@
+# stored_objects.py
+
+import logging
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from . import metrics
+from .models import StoredObject
+from .object_storage import get_object_storage
+
+
+logger = logging.getLogger(__name__)
+
+
+def delete_on_commit(bucket_name, object_name):
+    """Deletes an object once the transaction commits, a rollback keeps it referenced."""
+    def delete():
+        try:
+            with metrics.timed('gcs'):
+                get_object_storage().delete(bucket_name, object_name)
+        except Exception:
+            logger.warning('Could not delete object', exc_info=True,
+                           extra={'bucket': bucket_name, 'object': object_name})
+    transaction.on_commit(delete)
+
+
+def content_hash(object_name):
+    """
+    SHA-256 of an uploaded object, read back from storage so a client can
+    never claim an object by a hash it made up. Reads the whole object, keep
+    it out of transactions.
+    """
+    with metrics.timed('gcs'):
+        return get_object_storage().sha256(settings.GS_BUCKET_NAME, object_name)
+
+
+def claim(user, object_name, size, sha256):
+    """
+    Takes a reference on the user's StoredObject of these bytes, created from
+    the upload when there is none; otherwise the upload's own copy is deleted.
+    Scoped per user, another user's object name is never handed out.
+    """
+    with transaction.atomic():
+        stored = StoredObject.objects.select_for_update().filter(user=user, sha256=sha256).first()
+        if stored is None:
+            try:
+                with transaction.atomic():
+                    return StoredObject.objects.create(
+                        user=user, sha256=sha256, object_name=object_name, size=size, ref_count=1)
+            except IntegrityError:
+                # The same bytes finalised concurrently
+                stored = StoredObject.objects.select_for_update().get(user=user, sha256=sha256)
+        StoredObject.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + 1)
+        stored.ref_count += 1
+    if stored.object_name != object_name:
+        delete_on_commit(settings.GS_BUCKET_NAME, object_name)
+    return stored
+
+
+def release(stored_object_id, derived=()):
+    """
+    Drops a reference, the object is deleted with the last one along with the
+    derived objects named, which its media share.
+    """
+    StoredObject.objects.filter(pk=stored_object_id).update(ref_count=F('ref_count') - 1)
+    orphans = StoredObject.objects.filter(pk=stored_object_id, ref_count=0)
+    for object_name in orphans.values_list('object_name', flat=True):
+        for name in (object_name, *derived):
+            delete_on_commit(settings.GS_BUCKET_NAME, name)
+    orphans.delete()
@@ -0,0 +1,28 @@
+# tag_cache.py
+
+from django.conf import settings
+from . import versioned_cache
+
+
+CATALOGUE = 'tags:catalogue'
+
+
+def user_tags(user_id):
+    return f'tags:user:{user_id}'
+
+
+def get_version(name):
+    return versioned_cache.get_version(name, settings.TAG_CACHE_ALIAS)
+
+
+def invalidate(*names):
+    versioned_cache.invalidate(*names, alias=settings.TAG_CACHE_ALIAS)
+
+
+def get_versions(names):
+    return versioned_cache.get_versions(names, settings.TAG_CACHE_ALIAS)
+
+
+def cached_data(names, build):
+    return versioned_cache.cached_data(
+        names, build, settings.TAG_CACHE_TIMEOUT, settings.TAG_CACHE_ALIAS)
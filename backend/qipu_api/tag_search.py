@@ -0,0 +1,49 @@
+# tag_search.py
+
+from django.db.models import F
+from django.db.models.functions import Collate, Upper
+from .models import Tag, TagUsage
+
+
+# Candidates read per index before ranking, a few pages of autocomplete
+CANDIDATES = 50
+
+# Trigram indexes only help from three characters on
+MIN_SUBSTRING_LENGTH = 3
+
+
+def user_tag_usage(user, query):
+    """How many of the user's posts and media use each tag matching query."""
+    return dict(TagUsage.objects.filter(user=user, tag__name__icontains=query).annotate(
+        count=F('post_count') + F('media_count')).values_list('tag_id', 'count'))
+
+
+def search_tags(user, query, limit):
+    """
+    Tags matching query ranked exact match first, then prefix matches, then
+    other substring matches, and by the user's own usage within each group.
+
+    Every candidate comes from an index range scan bounded by CANDIDATES
+    (tag_name_prefix_idx for prefixes, the tag_name_trgm_idx trigram index for
+    substrings) plus the user's own tags, so the cost does not grow with the
+    size of the tag table.
+    """
+    key = query.upper()
+    prefix = Tag.objects.annotate(name_key=Collate(Upper('name'), 'C')).filter(
+        name_key__startswith=key).order_by('name_key')[:CANDIDATES]
+    candidates = {tag.id: tag for tag in prefix}
+    if len(query) >= MIN_SUBSTRING_LENGTH:
+        candidates.update((tag.id, tag) for tag in Tag.objects.filter(
+            name__icontains=query)[:CANDIDATES])
+
+    usage = user_tag_usage(user, query)
+    unseen = [tag_id for tag_id in usage if tag_id not in candidates]
+    if unseen:
+        candidates.update(Tag.objects.in_bulk(unseen))
+
+    def rank(tag):
+        name = tag.name.upper()
+        group = 0 if name == key else 1 if name.startswith(key) else 2
+        return group, -usage.get(tag.id, 0), len(name), name
+
+    return sorted(candidates.values(), key=rank)[:limit]
@@ -0,0 +1,18 @@
+# test_runner.py
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests with channel messages kept in the process, no Redis needed."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.channel_layers = override_settings(
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+        self.channel_layers.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.channel_layers.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,148 @@
+# timeline.py
+
+import calendar
+from datetime import timedelta
+from django.db import connection
+from django.db.models import CharField, F, Value
+from .models import Post, Media, PostTag, MediaTag
+
+
+# Same order and milestone counts as the columns drawn by Timeline.vue
+SCALES = ['hour', 'day', 'week', 'month', 'year', 'decade', 'century']
+
+FIXED_SPANS = {
+    'hour': (timedelta(hours=1), 4),
+    'day': (timedelta(days=1), 6),
+    'week': (timedelta(weeks=1), 7),
+    'decade': (timedelta(days=3652.425), 10),
+    'century': (timedelta(days=36524.25), 10),
+}
+
+
+def scale_window(scale, anchor):
+    """Returns (start, bucket_width, bucket_count) for a scale ending at anchor."""
+    if scale in FIXED_SPANS:
+        span, count = FIXED_SPANS[scale]
+    elif scale == 'month':
+        count = calendar.monthrange(anchor.year, anchor.month)[1]
+        span = timedelta(days=count)
+    elif scale == 'year':
+        span = timedelta(days=366 if calendar.isleap(anchor.year) else 365)
+        count = 12
+    else:
+        raise ValueError(f"Unknown scale: {scale}")
+    return anchor - span, span / count, count
+
+
+def timeline_rows(user, start, end, tag_ids=None):
+    """
+    The user's posts and media created in [start, end) as a single UNION
+    query of (id, created_time, type, text, kind).
+    """
+    posts = Post.objects.filter(
+        user=user, created_time__gte=start, created_time__lt=end)
+    media = Media.objects.filter(
+        user=user, created_time__gte=start, created_time__lt=end)
+    if tag_ids:
+        posts = posts.filter(id__in=PostTag.objects.filter(
+            tag_id__in=tag_ids).values('post_id'))
+        media = media.filter(id__in=MediaTag.objects.filter(
+            tag_id__in=tag_ids).values('media_id'))
+
+    fields = ('id', 'created_time', 'type', 'text', 'kind')
+    posts = posts.annotate(
+        type=Value('post', output_field=CharField()),
+        text=F('content'),
+        kind=Value('', output_field=CharField()),
+    ).values(*fields)
+    media = media.annotate(
+        type=Value('media', output_field=CharField()),
+        text=F('caption'),
+        kind=F('media_type'),
+    ).values(*fields)
+    return posts.union(media, all=True)
+
+
+def serialize_row(row):
+    item = {
+        'id': row['id'],
+        'type': row['type'],
+        'created_time': row['created_time'],
+        'tagIds': row['tagIds'],
+    }
+    if row['type'] == 'post':
+        item['content'] = row['text']
+    else:
+        item['caption'] = row['text']
+        item['media_type'] = row['kind']
+    return item
+
+
+def timeline_buckets(user, scales, anchor, limit, tag_ids=None):
+    """
+    Buckets of every requested scale in one query. The database counts the
+    rows of each bucket and ranks them with row_number(), only the newest
+    `limit` of a bucket come back, with their tag IDs. Bucket 0 is the one
+    closest to the anchor, like the positions computed client-side.
+    """
+    windows = {scale: scale_window(scale, anchor) for scale in scales}
+    rows_sql, rows_params = timeline_rows(
+        user, min(start for start, _, _ in windows.values()), anchor, tag_ids).query.sql_with_params()
+    # Bucket widths are whole seconds, numeric keeps the edges exact
+    scales_sql = ', '.join(['(%s, %s::timestamptz, %s::numeric)'] * len(windows))
+    scales_params = [value for scale, (start, width, _) in windows.items()
+                     for value in (scale, start, int(width.total_seconds()))]
+    sql = f"""
+        WITH timeline_rows (id, created_time, type, text, kind) AS ({rows_sql}),
+        scales (scale, start, width) AS (VALUES {scales_sql}),
+        bucketed AS (
+            SELECT scales.scale, timeline_rows.*,
+                   ceil(extract(epoch FROM %s::timestamptz - timeline_rows.created_time)
+                        / scales.width)::integer - 1 AS bucket
+            FROM timeline_rows JOIN scales ON timeline_rows.created_time >= scales.start
+        ),
+        ranked AS (
+            SELECT *, count(*) OVER bucket_rows AS bucket_count,
+                   row_number() OVER (bucket_rows ORDER BY created_time DESC, id DESC) AS position
+            FROM bucketed
+            WINDOW bucket_rows AS (PARTITION BY scale, bucket)
+        )
+        SELECT scale, bucket, bucket_count, id, created_time, type, text, kind,
+               CASE WHEN type = 'post'
+                    THEN ARRAY(SELECT tag_id FROM {PostTag._meta.db_table} WHERE post_id = ranked.id)
+                    ELSE ARRAY(SELECT tag_id FROM {MediaTag._meta.db_table} WHERE media_id = ranked.id)
+               END AS "tagIds"
+        FROM ranked
+        -- The first row carries the count of a bucket even with limit=0
+        WHERE position <= greatest(%s, 1)
+        ORDER BY scale, bucket, position
+    """
+
+    result = {}
+    for scale, (start, width, count) in windows.items():
+        result[scale] = {
+            'start': start,
+            'end': anchor,
+            'bucket_width': width.total_seconds(),
+            'total': 0,
+            'buckets': [{
+                'index': i,
+                'start': anchor - width * (i + 1),
+                'end': anchor - width * i,
+                'count': 0,
+                'items': [],
+            } for i in range(count)],
+        }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*rows_params, *scales_params, anchor, limit])
+        columns = [column[0] for column in cursor.description]
+        for values in cursor.fetchall():
+            row = dict(zip(columns, values))
+            scale = result[row['scale']]
+            bucket = scale['buckets'][row['bucket']]
+            if bucket['count'] == 0:
+                bucket['count'] = row['bucket_count']
+                scale['total'] += row['bucket_count']
+            if len(bucket['items']) < limit:
+                bucket['items'].append(serialize_row(row))
+    return result
@@ -0,0 +1,58 @@
+# uploads.py
+
+import os
+import uuid
+from . import metrics
+from .object_storage import get_object_storage
+
+
+# GCS only accepts chunks in multiples of 256 KiB, except the last one
+CHUNK_GRANULARITY = 256 * 1024
+
+
+class UploadNotFinished(Exception):
+    pass
+
+
+class UploadCorrupted(Exception):
+    pass
+
+
+def upload_object_name(filename):
+    _, extension = os.path.splitext(filename)
+    return f'{uuid.uuid4().hex}{extension.lower()}'
+
+
+def start_session(bucket_name, object_name, content_type, size, origin=None):
+    """
+    Opens a resumable upload session and returns its URL. The browser sends
+    the chunks straight to it; origin is echoed in its CORS headers.
+    """
+    with metrics.timed('gcs'):
+        return get_object_storage().start_upload(bucket_name, object_name, content_type, size, origin)
+
+
+def received_bytes(session_url, size):
+    """Bytes of the upload the storage has persisted, size once it is complete."""
+    with metrics.timed('gcs'):
+        return get_object_storage().received_bytes(session_url, size)
+
+
+def verify_upload(bucket_name, object_name, size, md5_hash):
+    """
+    Raises UploadNotFinished while the object does not exist, UploadCorrupted
+    if its size or MD5 (base64, as GCS reports it) differ from the announced
+    ones.
+    """
+    backend = get_object_storage()
+    with metrics.timed('gcs'):
+        info = backend.stat(bucket_name, object_name)
+    if info is None:
+        raise UploadNotFinished('The upload is not complete')
+    if info.size != size or info.md5_hash != md5_hash:
+        # A corrupt object is never used, the client starts a new session
+        with metrics.timed('gcs'):
+            backend.delete(bucket_name, object_name)
+        if info.size != size:
+            raise UploadCorrupted(f'Expected {size} bytes, the object had {info.size}')
+        raise UploadCorrupted('Checksum mismatch')
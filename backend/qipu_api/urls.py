@@ -7,7 +7,8 @@ from .views import (
     RelationshipLabelViewSet, TagSearchView, SignupView,
     LoginView, LogoutView, CheckSessionView, MediaDetailView,
     GenerateSignedURLView, AddItemView, PasswordResetRequestView, PasswordResetConfirmView,
-    TagViewSet
+    TagViewSet, TimelineView, MediaDetailBatchView, AddItemBatchView, MetricsView,
+    TagUsageView, FreeBusyView, UploadSessionViewSet, ObjectStorageView
 )
 
 router = DefaultRouter()
@@ -20,6 +21,7 @@ router.register(r'attendees', AttendeeViewSet)
 router.register(r'uniques', UniqueViewSet)
 router.register(r'relationship_labels', RelationshipLabelViewSet)
 router.register(r'tags', TagViewSet, basename='tags')
+router.register(r'uploads', UploadSessionViewSet, basename='uploads')
 
 urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
@@ -28,11 +30,21 @@ urlpatterns = [
     path('', include(router.urls)),
     path('check_session/', CheckSessionView.as_view(), name='check_session'),
     path('tag_search/', TagSearchView.as_view(), name='tag_search'),
+    path('tag_usage/', TagUsageView.as_view(), name='tag_usage'),
+    path('timeline/', TimelineView.as_view(), name='timeline'),
+    path('freebusy/', FreeBusyView.as_view(), name='freebusy'),
+    path('media-detail/batch/', MediaDetailBatchView.as_view(),
+         name='media-detail-batch'),
+    # Must match the path of OBJECT_STORAGE_URL
+    path('storage/<str:bucket_name>/<path:object_name>', ObjectStorageView.as_view(),
+         name='object-storage'),
     path('media-detail/<int:media_id>/',
          MediaDetailView.as_view(), name='media-detail'),
     path('generate-signed-url/', GenerateSignedURLView.as_view(),
          name='generate-signed-url'),
     path('items/add/', AddItemView.as_view(), name='add-item'),
+    path('items/add/batch/', AddItemBatchView.as_view(), name='add-item-batch'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('password-reset/', PasswordResetRequestView.as_view(),
          name='password_reset'),
     path('password-reset-confirm/<uidb64>/<token>/',
@@ -2,13 +2,37 @@
 
 import os
 import uuid
+import time
+import logging
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import caches
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from django.db import connections
 from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
-from google.cloud import storage
 from datetime import timedelta
 from storages.backends.gcloud import GoogleCloudStorage
+from storages.utils import clean_name
 from urllib.parse import urlparse
+from . import metrics
+from .authentication import CookieJWTAuthentication, TOKEN_COOKIE
+from .object_storage import (get_object_storage, HostedObjectStorage, get_storage_client, get_bucket,
+                             reset_storage_client)
+
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger('qipu_api.requests')
 
 
 # code proposé par ChatGPT3.5 tel quel
@@ -30,7 +54,7 @@ def validate_bio_length(value):
 def set_token_cookie(response: HttpResponse, token: str) -> None:
     """Sets the JWT token as a httpOnly cookie."""
     response.set_cookie(
-        key='authToken',
+        key=TOKEN_COOKIE,
         value=token,
         httponly=True,
         samesite='None',  # Setting the SameSite attribute to 'None'
@@ -39,22 +63,86 @@ def set_token_cookie(response: HttpResponse, token: str) -> None:
     )
 
 
-class TokenFromCookieMiddleware:
+class JWTCookieAuthMiddleware:
+    """
+    WebSocket counterpart of CookieJWTAuthentication: authenticates the
+    authToken cookie (parsed by channels' CookieMiddleware) into scope['user'].
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        token = scope.get('cookies', {}).get('authToken')
+        user = await get_token_user(token) if token else AnonymousUser()
+        return await self.inner(dict(scope, user=user), receive, send)
+
+
+@database_sync_to_async
+def get_token_user(token):
+    authentication = CookieJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+
+class RequestLogMiddleware:
+    """
+    One structured record per request on the `qipu_api.requests` logger.
+    Successful requests are sampled by the logger's filter, server errors
+    are logged as warnings so they are always kept.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        token = request.COOKIES.get('authToken', None)
-        if token:
-            print("Token extracted:", token)
-            request.META['HTTP_AUTHORIZATION'] = f"Bearer {token}"
-            print("Authorization header set:",
-                  request.META['HTTP_AUTHORIZATION'])
-        else:
-            print("No token found in cookies.")
-
+        started = time.monotonic()
         response = self.get_response(request)
-        print("Response status:", response.status_code)
+        level = logging.WARNING if response.status_code >= 500 else logging.INFO
+        if request_logger.isEnabledFor(level):
+            match = request.resolver_match
+            request_logger.log(level, 'request', extra={
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'duration_ms': round((time.monotonic() - started) * 1000, 2),
+            })
+        return response
+
+
+class PerformanceMiddleware:
+    """
+    Opt-in (PERF_INSTRUMENTATION) per-request instrumentation: wall time, DB
+    query count and time, cache hits and misses and GCS signing time. They are
+    sent back in a Server-Timing header and aggregated per view in
+    metrics.registry, served by MetricsView.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PERF_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics, token = metrics.start()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(request_metrics.db_wrapper))
+                response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        wall = time.perf_counter() - started
+
+        response['Server-Timing'] = request_metrics.server_timing(wall)
+        match = request.resolver_match
+        metrics.registry.record(
+            match.view_name if match else '<unresolved>', request_metrics, wall)
         return response
 
 
@@ -67,8 +155,9 @@ class RedirectAuthenticatedUserMiddleware:
         return response
 
     def process_view(self, request, view_func, view_args, view_kwargs):
-        if request.user.is_authenticated:
-            if request.path in [reverse('login'), reverse('signup')]:
+        # Path first, request.user would load the session of every API request
+        if request.path in [reverse('login'), reverse('signup')]:
+            if request.user.is_authenticated:
                 return redirect('Dashboard')
         return None
 
@@ -76,29 +165,186 @@ class RedirectAuthenticatedUserMiddleware:
 
 
 def generate_signed_url(bucket_name, object_name, content_type=None, expiration=timedelta(minutes=60), method='GET'):
-    """Generates a signed URL for a GCS object."""
+    """Generates a signed URL for an object of the storage backend."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(object_name)
-        signed_url = blob.generate_signed_url(
-            expiration=expiration,
-            version="v4",
-            method=method,
-            content_type=content_type  # Include content_type if provided
-        )
-        print("Generated Signed URL:", signed_url)
+        with metrics.timed('gcs'):
+            signed_url = get_object_storage().sign_url(
+                bucket_name, object_name, expiration, method=method,
+                content_type=content_type,  # Include content_type if provided
+            )
+        logger.debug('Generated signed URL', extra={
+            'bucket': bucket_name, 'object': object_name, 'method': method})
         return signed_url
-    except Exception as e:
-        print("Error generating signed URL:", str(e))
+    except Exception:
+        logger.exception('Error generating signed URL', extra={
+            'bucket': bucket_name, 'object': object_name, 'method': method})
         raise
 
 
+class SignedURLCache:
+    """
+    Signed URLs keyed by (bucket, object, method, content_type).
+
+    Entries live in the shared Django cache so every worker reuses them, with
+    a small per-process LRU in front to skip the cache round-trip on hot
+    objects. An entry is served until it gets within `refresh_margin` of its
+    expiry, after which the caller signs a fresh URL.
+    """
+
+    def __init__(self, alias='default', max_entries=1024, refresh_margin=timedelta(minutes=5)):
+        self.alias = alias
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin.total_seconds()
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(bucket_name, object_name, method, content_type):
+        raw = '\n'.join([bucket_name or '', object_name,
+                         method.upper(), content_type or ''])
+        return 'signed-url:' + hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[1] - self.refresh_margin > now:
+                    self._local.move_to_end(key)
+                    metrics.record_cache(hit=True)
+                    return entry[0]
+                del self._local[key]
+
+        entry = caches[self.alias].get(key)
+        if entry is None or entry[1] - self.refresh_margin <= now:
+            metrics.record_cache(hit=False)
+            return None
+        self._remember(key, entry)
+        metrics.record_cache(hit=True)
+        return entry[0]
+
+    def set(self, key, url, expiration):
+        expires_at = time.time() + expiration.total_seconds()
+        entry = (url, expires_at)
+        # Evicted by the shared cache as soon as it is no longer servable
+        timeout = expiration.total_seconds() - self.refresh_margin
+        if timeout > 0:
+            caches[self.alias].set(key, entry, timeout=timeout)
+            self._remember(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+
+signed_url_cache = SignedURLCache(
+    alias=settings.SIGNED_URL_CACHE_ALIAS,
+    max_entries=settings.SIGNED_URL_CACHE_SIZE,
+    refresh_margin=settings.SIGNED_URL_REFRESH_MARGIN,
+)
+
+
+def get_signed_url(bucket_name, object_name, content_type=None, expiration=None, method='GET'):
+    """Returns a cached signed URL for a GCS object, signing one on a miss."""
+    if expiration is None:
+        expiration = settings.SIGNED_URL_EXPIRATION
+    key = signed_url_cache.make_key(bucket_name, object_name, method, content_type)
+    signed_url = signed_url_cache.get(key)
+    if signed_url is None:
+        signed_url = generate_signed_url(
+            bucket_name, object_name, content_type=content_type,
+            expiration=expiration, method=method)
+        signed_url_cache.set(key, signed_url, expiration)
+    return signed_url
+
+
+_signing_pool = None
+_signing_lock = threading.Lock()
+
+
+def _get_signing_pool():
+    global _signing_pool
+    if _signing_pool is None:
+        with _signing_lock:
+            if _signing_pool is None:
+                _signing_pool = ThreadPoolExecutor(
+                    max_workers=settings.SIGNED_URL_MAX_WORKERS,
+                    thread_name_prefix='gcs-sign')
+    return _signing_pool
+
+
+def get_signed_urls(bucket_name, object_names, content_type=None, expiration=None, method='GET'):
+    """
+    Signed URLs for many objects, in order. Cache hits are answered directly,
+    misses are signed in parallel on a bounded thread pool. A failed object
+    gets its exception in place of a URL instead of failing the whole batch.
+    """
+    if expiration is None:
+        expiration = settings.SIGNED_URL_EXPIRATION
+    results = []
+    misses = {}
+    for index, object_name in enumerate(object_names):
+        key = signed_url_cache.make_key(bucket_name, object_name, method, content_type)
+        signed_url = signed_url_cache.get(key)
+        results.append(signed_url)
+        if signed_url is None:
+            misses.setdefault((key, object_name), []).append(index)
+
+    def sign(key, object_name):
+        signed_url = generate_signed_url(
+            bucket_name, object_name, content_type=content_type,
+            expiration=expiration, method=method)
+        signed_url_cache.set(key, signed_url, expiration)
+        return signed_url
+
+    pool = _get_signing_pool()
+    # Each task runs in a copy of this context so its timings reach the request
+    futures = {pool.submit(contextvars.copy_context().run, sign, *miss): indexes
+               for miss, indexes in misses.items()}
+    for future, indexes in futures.items():
+        try:
+            signed_url = future.result()
+        except Exception as e:
+            signed_url = e
+        for index in indexes:
+            results[index] = signed_url
+    return results
+
+
+def media_object_name(storage_name):
+    """Object name in the bucket of a Media.storage_file value, which may be a full URL."""
+    backend = get_object_storage()
+    if isinstance(backend, HostedObjectStorage) and storage_name.startswith(settings.OBJECT_STORAGE_URL):
+        return backend.parse_url(storage_name)[1]
+    if storage_name.startswith('https://') or storage_name.startswith('http://'):
+        object_name = urlparse(storage_name).path.lstrip('/')
+    else:
+        object_name = storage_name
+
+    object_name = object_name.strip('/')
+    if object_name.startswith('qip_media/'):
+        object_name = object_name.replace('qip_media/', '', 1)
+    return object_name
+
+
 
 class CustomGoogleCloudStorage(GoogleCloudStorage):
+    @property
+    def client(self):
+        return get_storage_client()
+
+    @property
+    def bucket(self):
+        return get_bucket(self.bucket_name)
+
     def url(self, name):
-        url = super().url(name)
-        parsed_url = urlparse(url)
-        new_url = f"https://storage.cloud.google.com{parsed_url.path}"
-        print(f"Generated URL: {new_url}")  # Debug statement
-        return new_url
+        # Same path as the signed URL would have, without signing anything
+        name = self._normalize_name(clean_name(name))
+        return get_object_storage().object_url(self.bucket_name, name)
@@ -0,0 +1,52 @@
+# versioned_cache.py
+
+import time
+from django.core.cache import caches
+from django.db import transaction
+from . import metrics
+
+
+def get_version(name, alias='default'):
+    """Current version of a cached collection, started on first use."""
+    key = f'{name}:version'
+    cache = caches[alias]
+    version = cache.get(key)
+    metrics.record_cache(hit=version is not None)
+    if version is None:
+        # Never reuse a version, one lost to eviction may still be in an ETag
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(*names, alias='default'):
+    """
+    Moves the collections to a new version once the transaction commits, so a
+    concurrent read cannot store the old rows under the new version.
+    """
+    def bump():
+        for name in names:
+            try:
+                caches[alias].incr(f'{name}:version')
+            except ValueError:
+                # Not started yet, the next read starts a fresh version
+                pass
+    transaction.on_commit(bump)
+
+
+def get_versions(names, alias='default'):
+    return '.'.join(str(get_version(name, alias)) for name in names)
+
+
+def cached_data(names, build, timeout, alias='default'):
+    """
+    Data built by build(), cached under the current versions of the
+    collections it depends on.
+    """
+    key = f'{names[-1]}:{get_versions(names, alias)}:data'
+    data = caches[alias].get(key)
+    metrics.record_cache(hit=data is not None)
+    if data is None:
+        data = build()
+        caches[alias].set(key, data, timeout)
+    return data
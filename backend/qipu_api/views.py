@@ -1,28 +1,46 @@
 from datetime import datetime
 from django.conf import settings
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers, mixins
 import requests
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q
 from rest_framework.generics import ListAPIView
 from django.contrib.auth import authenticate
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.exceptions import ValidationError
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound
 from django.http import JsonResponse
-from django.http import HttpResponse
-from .utility import set_token_cookie, generate_signed_url, CustomGoogleCloudStorage
-from .permissions import IsOwner, IsOwnerOrInvolved, PermissionMixin
+from django.http import HttpResponse, FileResponse
+from django.core.files.storage import default_storage
+from .utility import set_token_cookie, get_signed_url, get_signed_urls
+from .permissions import IsOwner, IsOwnerOrInvolved, PermissionMixin, owned_by
+from .pagination import CreatedTimeCursorPagination
+from .conditional import ConditionalListMixin
+from . import metrics
+from .signals import publish_on_commit, CREATED
+from .timeline import SCALES, timeline_buckets
+from .tag_search import search_tags
+from .occurrences import occurrences, busy_intervals_by_user
+from .media_processing import pick_object
+from .uploads import (upload_object_name, start_session, received_bytes, verify_upload,
+                      UploadNotFinished, UploadCorrupted)
+from . import tag_cache, contact_graph, media_processing, stored_objects
+from .object_storage import get_object_storage, HostedObjectStorage, check_signature
+import mimetypes
+import re
 from urllib.parse import urlparse
-from .models import User, Media, Post, Event, Contact, Attendee, Unique, RelationshipLabel, Tag, MediaTag, PostTag
+from .models import (User, Media, Post, Event, Contact, Attendee, Unique, RelationshipLabel, Tag, MediaTag, PostTag,
+                     TagUsage, UploadSession)
 from .serializers import (UserSerializer, MediaSerializer, PostSerializer,
                           EventSerializer, ContactSerializer, AttendeeSerializer,
-                          UniqueSerializer, RelationshipLabelSerializer, TagSerializer,
+                          UniqueSerializer, RelationshipLabelSerializer, TagSerializer, TagUsageSerializer,
+                          InvitationSerializer, RSVPSerializer, UploadSessionSerializer,
                           PasswordResetRequestSerializer, PasswordResetSerializer)
-import os
 import dotenv
 import pytest
 from django.utils.crypto import get_random_string
@@ -31,6 +49,12 @@ from django.contrib.auth.tokens import default_token_generator
 from django.urls import reverse
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 
 class SignupView(APIView):
@@ -91,6 +115,8 @@ class CheckSessionView(APIView):
     def get(self, request, *args, **kwargs):
         user = request.user
         if user.is_authenticated:
+            # Token authentication only loads id and is_active
+            user = User.objects.get(pk=user.pk)
             return Response({'user': UserSerializer(user).data})
         else:
             raise ValidationError({'error': 'Not Authenticated'})
@@ -101,9 +127,11 @@ class UserViewSet(PermissionMixin, ModelViewSet):
     serializer_class = UserSerializer
 
 
-class MediaViewSet(PermissionMixin, viewsets.ModelViewSet):
-    queryset = Media.objects.all()
+class MediaViewSet(ConditionalListMixin, PermissionMixin, viewsets.ModelViewSet):
+    # Tag IDs of the whole page are loaded in one extra query
+    queryset = Media.objects.prefetch_related('mediatag_set')
     serializer_class = MediaSerializer
+    pagination_class = CreatedTimeCursorPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -111,14 +139,20 @@ class MediaViewSet(PermissionMixin, viewsets.ModelViewSet):
         if tag_ids:
             tag_id_list = [int(tag_id)
                            for tag_id in tag_ids.split(',') if tag_id.isdigit()]
-            queryset = queryset.filter(
-                mediatag__tag__id__in=tag_id_list, user=self.request.user)
+            queryset = queryset.filter(mediatag__tag__id__in=tag_id_list)
         return queryset
 
+    def get_collection_version(self):
+        # tagIds are part of the payload, links are versioned by the tag cache
+        version, last_modified = super().get_collection_version()
+        links = tag_cache.get_versions([tag_cache.user_tags(self.request.user.id)])
+        return f'{version}:{links}', last_modified
+
 
-class PostViewSet(PermissionMixin, viewsets.ModelViewSet):
-    queryset = Post.objects.all()
+class PostViewSet(ConditionalListMixin, PermissionMixin, viewsets.ModelViewSet):
+    queryset = Post.objects.prefetch_related('posttag_set')
     serializer_class = PostSerializer
+    pagination_class = CreatedTimeCursorPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -126,26 +160,165 @@ class PostViewSet(PermissionMixin, viewsets.ModelViewSet):
         if tag_ids:
             tag_id_list = [int(tag_id)
                            for tag_id in tag_ids.split(',') if tag_id.isdigit()]
-            queryset = queryset.filter(
-                posttag__tag__id__in=tag_id_list, user=self.request.user)
+            queryset = queryset.filter(posttag__tag__id__in=tag_id_list)
         return queryset
 
+    def get_collection_version(self):
+        # tagIds are part of the payload, links are versioned by the tag cache
+        version, last_modified = super().get_collection_version()
+        links = tag_cache.get_versions([tag_cache.user_tags(self.request.user.id)])
+        return f'{version}:{links}', last_modified
 
-class EventViewSet(PermissionMixin, ModelViewSet):
+
+def parse_window(params, required=False):
+    """(start, end) from the start/end query parameters, None if both are absent."""
+    if not required and 'start' not in params and 'end' not in params:
+        return None
+    window = []
+    for name in ('start', 'end'):
+        try:
+            moment = parse_datetime(params.get(name, ''))
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({'error': f'{name} must be an ISO 8601 datetime'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        window.append(moment)
+    if window[1] <= window[0]:
+        raise ValidationError({'error': 'end must be after start'})
+    return window
+
+
+class EventViewSet(ConditionalListMixin, PermissionMixin, ModelViewSet):
+    """
+    With ?start=&end= the list returns the occurrences in that window: plain
+    events, the expansion of recurring series, and their overrides in place of
+    the occurrences they replace. Cancelled occurrences are left out.
+    """
     queryset = Event.objects.all()
     serializer_class = EventSerializer
 
-
-class ContactViewSet(PermissionMixin, ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        window = parse_window(request.query_params)
+        if window is None:
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(
+            request, lambda: Response(self.window_occurrences(*window)))
+
+    def window_occurrences(self, start, end):
+        moment = serializers.DateTimeField().to_representation
+        data = {}
+        items = []
+        for occurrence in occurrences(self.filter_queryset(self.get_queryset()), start, end):
+            event = occurrence.event
+            if event.pk not in data:
+                data[event.pk] = self.get_serializer(event).data
+            if occurrence.occurrence_start is None:
+                items.append(data[event.pk])
+            else:
+                items.append({
+                    **data[event.pk],
+                    'start_time': moment(occurrence.start),
+                    'end_time': moment(occurrence.end),
+                    'occurrence_start': moment(occurrence.occurrence_start),
+                })
+        return items
+
+
+class ContactViewSet(ConditionalListMixin, PermissionMixin, ModelViewSet):
+    """
+    graph and mutual are served from the cached contact adjacency of each
+    user (see contact_graph), no Contact row is read on a cache hit.
+    """
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrInvolved]
 
-
-class AttendeeViewSet(PermissionMixin, ModelViewSet):
+    @action(detail=False)
+    def graph(self, request, *args, **kwargs):
+        """User ids of accepted contacts, pending inbox and outbox, and contacts per label id."""
+        adjacency = contact_graph.get_adjacency(request.user.pk)
+        return Response({
+            contact_graph.ACCEPTED: list(adjacency[contact_graph.ACCEPTED]),
+            contact_graph.INBOX: list(adjacency[contact_graph.INBOX]),
+            contact_graph.OUTBOX: list(adjacency[contact_graph.OUTBOX]),
+            'labels': {label_id: list(members) for label_id, members in adjacency['labels'].items()},
+        })
+
+    @action(detail=False, url_path=r'mutual/(?P<user_id>[0-9]+)')
+    def mutual(self, request, user_id, *args, **kwargs):
+        """Accepted contacts the current user and user_id, one of them, have in common."""
+        mutual = contact_graph.mutual_contacts(request.user.pk, int(user_id))
+        if mutual is None:
+            raise NotFound()
+        return Response({'mutual': mutual})
+
+
+class AttendeeViewSet(ConditionalListMixin, PermissionMixin, ModelViewSet):
+    """
+    invite and rsvp handle many rows per request, permissions checked for the
+    whole set in one query.
+    """
     queryset = Attendee.objects.all()
     serializer_class = AttendeeSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrInvolved]
+    max_items = 500
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('event')
+
+    def get_items(self, serializer_class):
+        items = self.request.data.get('items')
+        if not isinstance(items, list):
+            raise ValidationError({'error': 'items must be a list of objects'})
+        if len(items) > self.max_items:
+            raise ValidationError({'error': f'At most {self.max_items} items per request'})
+        serializer = serializer_class(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @action(detail=False, methods=['post'])
+    def invite(self, request, *args, **kwargs):
+        """items: [{event, user}], for events of the current user. Existing invitations are kept."""
+        items = self.get_items(InvitationSerializer)
+        event_ids = {item['event'] for item in items}
+        user_ids = {item['user'] for item in items}
+        with transaction.atomic():
+            # Concurrent invitations to the same events wait here, in pk order
+            owned = set(Event.objects.select_for_update().filter(
+                pk__in=event_ids, user=request.user).order_by('pk').values_list('pk', flat=True))
+            if owned != event_ids:
+                raise PermissionDenied(
+                    f"Not your events: {', '.join(map(str, sorted(event_ids - owned)))}")
+            unknown = user_ids - set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+            if unknown:
+                raise ValidationError({'error': f"Unknown users: {', '.join(map(str, sorted(unknown)))}"})
+            invited = set(Attendee.objects.filter(
+                event_id__in=event_ids, user_id__in=user_ids).values_list('event_id', 'user_id'))
+            new = {(item['event'], item['user']) for item in items} - invited
+            attendees = Attendee.objects.bulk_create(
+                [Attendee(event_id=event_id, user_id=user_id) for event_id, user_id in sorted(new)])
+        return Response(self.get_serializer(attendees, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def rsvp(self, request, *args, **kwargs):
+        """items: [{attendee, status}], for invitations of the current user."""
+        items = self.get_items(RSVPSerializer)
+        answers = {item['attendee']: item['status'] for item in items}
+        with transaction.atomic():
+            attendees = list(Attendee.objects.select_for_update().filter(pk__in=answers, user=request.user))
+            missing = set(answers) - {attendee.pk for attendee in attendees}
+            if missing:
+                raise PermissionDenied(
+                    f"Not your invitations: {', '.join(map(str, sorted(missing)))}")
+            now = timezone.now()
+            for attendee in attendees:
+                attendee.status = answers[attendee.pk]
+                # bulk_update skips auto_now
+                attendee.updated_at = now
+            Attendee.objects.bulk_update(attendees, ['status', 'updated_at'])
+        return Response(self.get_serializer(attendees, many=True).data)
 
 
 class UniqueViewSet(PermissionMixin, ModelViewSet):
@@ -158,70 +331,248 @@ class RelationshipLabelViewSet(PermissionMixin, ModelViewSet):
     serializer_class = RelationshipLabelSerializer
 
 
-class TagViewSet(PermissionMixin, viewsets.ModelViewSet):
+class TagViewSet(ConditionalListMixin, PermissionMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_collection_version(self):
+        # Kept by the tag write signals, no query needed
+        return tag_cache.get_versions([tag_cache.CATALOGUE]), None
+
+    def list(self, request, *args, **kwargs):
+        # The whole catalogue, served from the versioned tag cache
+        return self.conditional_response(request, lambda: Response(tag_cache.cached_data(
+            [tag_cache.CATALOGUE], lambda: list(self.get_serializer(
+                self.filter_queryset(self.get_queryset()), many=True).data))))
+
 
 class TagSearchView(ListAPIView):
+    """Autocomplete for Tags.vue, see tag_search.search_tags for the ranking."""
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticated]
+    default_limit = 4
+    max_limit = 20
 
     def get_queryset(self):
-        query = self.request.query_params.get('q', '')
-        queryset = Tag.objects.filter(name__icontains=query)[:4]
-        return queryset
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            return []
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'error': 'limit must be an integer'})
+        return search_tags(self.request.user, query, max(1, min(limit, self.max_limit)))
+
+
+class TagUsageView(ConditionalListMixin, ListAPIView):
+    """
+    The current user's tags with their post and media counts, most used first.
+    Reads the TagUsage counters, one row per tag whatever the number of items.
+    """
+    serializer_class = TagUsageSerializer
+    permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return TagUsage.objects.filter(user=self.request.user).select_related('tag').order_by(
+            -(F('post_count') + F('media_count')), 'tag__name')
 
-from urllib.parse import urlparse
+    def get_versioned_names(self):
+        # Tag names come from the catalogue, so it versions this list too
+        return [tag_cache.CATALOGUE, tag_cache.user_tags(self.request.user.id)]
 
-class MediaDetailView(APIView):
+    def get_collection_version(self):
+        return tag_cache.get_versions(self.get_versioned_names()), None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: Response(tag_cache.cached_data(
+            self.get_versioned_names(),
+            lambda: list(self.get_serializer(self.get_queryset(), many=True).data))))
+
+
+class TimelineView(APIView):
+    """
+    Posts and media of the current user, merged and pre-bucketed for the
+    Dashboard timescales. Buckets are counted and cut to ?limit= items in the
+    database, only those items are returned.
+    """
     permission_classes = [IsAuthenticated]
+    default_limit = 50
+    max_limit = 200
+
+    def get(self, request, *args, **kwargs):
+        scales = [scale for scale in request.query_params.get(
+            'scale', '').split(',') if scale] or SCALES
+        unknown = [scale for scale in scales if scale not in SCALES]
+        if unknown:
+            raise ValidationError(
+                {'error': f"Unknown scale: {', '.join(unknown)}"})
+
+        anchor = request.query_params.get('anchor')
+        if anchor:
+            anchor = parse_datetime(anchor)
+            if anchor is None:
+                raise ValidationError({'error': 'Invalid anchor'})
+            if timezone.is_naive(anchor):
+                anchor = timezone.make_aware(anchor)
+        else:
+            anchor = timezone.now()
 
-    def get(self, request, media_id):
         try:
-            media_object = Media.objects.get(pk=media_id)
-            object_url = media_object.storage_file.name
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'error': 'Invalid limit'})
+        limit = max(0, min(limit, self.max_limit))
+
+        tag_ids = request.query_params.get('tag', '')
+        tag_id_list = [int(tag_id)
+                       for tag_id in tag_ids.split(',') if tag_id.isdigit()]
+
+        return Response({
+            'anchor': anchor,
+            'scales': timeline_buckets(request.user, scales, anchor, limit, tag_id_list),
+        })
+
+
+class FreeBusyView(APIView):
+    """
+    Busy intervals of the current user and of accepted contacts between
+    ?start= and ?end=, overlapping occurrences merged. ?users= picks some of
+    them by id. Only the times are returned, not the events.
+    """
+    permission_classes = [IsAuthenticated]
 
-            # Debugging output
-            print(f"Object URL from database: {object_url}")
+    def get(self, request, *args, **kwargs):
+        start, end = parse_window(request.query_params, required=True)
+        user = request.user
+        visible = {user.pk}
+        for requester, recipient in Contact.objects.filter(
+                Q(requester=user) | Q(recipient=user), status='accepted').values_list(
+                'requester_id', 'recipient_id'):
+            visible.update((requester, recipient))
+
+        requested = request.query_params.get('users', '')
+        user_ids = [int(user_id) for user_id in requested.split(',') if user_id.isdigit()]
+        if not user_ids:
+            user_ids = sorted(visible)
+        hidden = [user_id for user_id in user_ids if user_id not in visible]
+        if hidden:
+            raise PermissionDenied(
+                f"Not a contact: {', '.join(map(str, hidden))}")
+
+        # One read for every user, however many contacts
+        busy = busy_intervals_by_user(Event.objects.filter(user_id__in=user_ids), start, end)
+        return Response({
+            'start': start,
+            'end': end,
+            'users': [{
+                'user': user_id,
+                'busy': [{'start': lower, 'end': upper} for lower, upper in busy.get(user_id, [])],
+            } for user_id in user_ids],
+        })
+
+
+def media_detail_data(media_object, signed_url):
+    return {
+        'id': media_object.id,
+        'caption': media_object.caption,
+        'media_type': media_object.media_type,
+        'signed_url': signed_url,
+        'user': media_object.user.username,
+        'width': media_object.width,
+        'height': media_object.height,
+        'duration': media_object.duration,
+    }
+
+
+def display_size(value):
+    """Longest edge in pixels the client displays the media at, None for the original."""
+    if value in (None, ''):
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0:
+        raise ValidationError({'error': 'size must be a positive number of pixels'})
+    return size
 
-            if object_url.startswith('https://') or object_url.startswith('http://'):
-                parsed_url = urlparse(object_url)
-                object_name = parsed_url.path.lstrip('/')
-            else:
-                object_name = object_url
 
-            object_name = object_name.strip('/')
-            if object_name.startswith('qip_media/'):
-                object_name = object_name.replace('qip_media/', '', 1)
+class MediaDetailView(APIView):
+    permission_classes = [IsAuthenticated]
 
-            # Generate the signed URL for fetching the media
-            signed_url = generate_signed_url(
-                bucket_name=os.environ.get('GS_BUCKET_NAME'),
+    def get(self, request, media_id):
+        try:
+            size = display_size(request.query_params.get('size'))
+            # Other users' media are as missing as unknown ids
+            media_object = owned_by(Media.objects.select_related('user'), request.user).get(pk=media_id)
+            # The smallest derivative covering ?size=, the original without it
+            object_name = pick_object(media_object, size)
+
+            logger.debug('Media object', extra={
+                'media_id': media_id, 'object_name': object_name})
+
+            # Signed URLs are reused from the cache until close to expiry
+            signed_url = get_signed_url(
+                bucket_name=settings.GS_BUCKET_NAME,
                 object_name=object_name,
                 content_type=None,  # GET request does not need content_type
                 method='GET'
             )
 
-            media_data = {
-                'id': media_object.id,
-                'caption': media_object.caption,
-                'media_type': media_object.media_type,
-                'signed_url': signed_url,
-                'user': media_object.user.username
-            }
-
-            return Response(media_data)
+            return Response(media_detail_data(media_object, signed_url))
 
         except Media.DoesNotExist:
             return Response({'error': 'Media object not found'}, status=404)
+        except ValidationError:
+            raise
         except Exception as e:
-            print(f"Error fetching media details: {str(e)}")  # Print the error for debugging
+            logger.exception('Error fetching media details', extra={'media_id': media_id})
             return Response({'error': str(e)}, status=500)
 
 
+class MediaDetailBatchView(APIView):
+    """
+    Same data as MediaDetailView for many media at once: one query for the
+    rows, and the missing signed URLs signed in parallel. size in the body
+    picks derivatives as ?size= does for one media.
+    """
+    permission_classes = [IsAuthenticated]
+    max_ids = 500
+
+    def post(self, request, *args, **kwargs):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(
+                isinstance(media_id, int) for media_id in ids):
+            raise ValidationError({'error': 'ids must be a list of integers'})
+        if len(ids) > self.max_ids:
+            raise ValidationError(
+                {'error': f'At most {self.max_ids} ids per request'})
+
+        size = display_size(request.data.get('size'))
+
+        # Other users' media are reported as missing, like unknown ids
+        media_objects = owned_by(Media.objects.select_related('user'), request.user).in_bulk(ids)
+        found = [media_objects[media_id]
+                 for media_id in dict.fromkeys(ids) if media_id in media_objects]
+        signed_urls = get_signed_urls(
+            bucket_name=settings.GS_BUCKET_NAME,
+            object_names=[pick_object(media_object, size) for media_object in found],
+        )
+
+        results = []
+        for media_object, signed_url in zip(found, signed_urls):
+            if isinstance(signed_url, Exception):
+                results.append({'id': media_object.id,
+                                'error': str(signed_url)})
+            else:
+                results.append(media_detail_data(media_object, signed_url))
+        return Response({
+            'results': results,
+            'missing': [media_id for media_id in dict.fromkeys(ids)
+                        if media_id not in media_objects],
+        })
+
 
 
 
@@ -238,18 +589,180 @@ class GenerateSignedURLView(APIView):
             return Response({'error': 'Missing filename or contentType'}, status=400)
 
         try:
-            bucket_name = os.environ.get('GS_BUCKET_NAME')
-            signed_url = generate_signed_url(bucket_name, filename, content_type, method='PUT')
-            print("Generated Signed URL:", signed_url)
+            bucket_name = settings.GS_BUCKET_NAME
+            signed_url = get_signed_url(bucket_name, filename, content_type, method='PUT')
             return Response({'signedUrl': signed_url})
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
 
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+)')
+
+
+def media_type(content_type):
+    return content_type.split(';')[0].strip().lower()
 
 
+def read_body(request, length):
+    """The request body in pieces, at most length bytes, never all in memory."""
+    stream = request.stream
+    while stream is not None and length > 0:
+        chunk = stream.read(min(length, 1024 * 1024))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
 
 
+class ObjectStorageView(APIView):
+    """
+    Serves the objects of the filesystem and memory storage backends through
+    the URLs they sign: GET downloads an object, PUT uploads a whole one or,
+    with a Content-Range, a chunk of a resumable upload session answered the
+    way GCS does (308 and Range until complete).
+    """
+    # The signature is the only credential, as with a GCS signed URL
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get_backend(self, request, method, bucket_name, object_name):
+        backend = get_object_storage()
+        if not isinstance(backend, HostedObjectStorage):
+            raise NotFound()
+        if not check_signature(method, bucket_name, object_name, request.query_params):
+            raise PermissionDenied('Invalid or expired signature')
+        content_type = request.query_params.get('content_type')
+        # Parameters such as charset do not change what was signed
+        if content_type and media_type(request.content_type) != media_type(content_type):
+            raise PermissionDenied('Content-Type differs from the signed one')
+        return backend
+
+    def get(self, request, bucket_name, object_name):
+        backend = self.get_backend(request, 'GET', bucket_name, object_name)
+        try:
+            source = backend.open(bucket_name, object_name)
+        except FileNotFoundError:
+            raise NotFound()
+        content_type, _ = mimetypes.guess_type(object_name)
+        return FileResponse(source, content_type=content_type or 'application/octet-stream')
+
+    def put(self, request, bucket_name, object_name):
+        backend = self.get_backend(request, 'PUT', bucket_name, object_name)
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        content_range = request.headers.get('Content-Range')
+        if content_range is None:
+            backend.write(bucket_name, object_name, read_body(request, length))
+            return HttpResponse(status=status.HTTP_200_OK)
+
+        match = CONTENT_RANGE_PATTERN.fullmatch(content_range)
+        if match is None:
+            return Response({'error': 'Invalid Content-Range'}, status=status.HTTP_400_BAD_REQUEST)
+        first, last, size = match.groups()
+        size = int(size)
+        if first is None:
+            received = backend.received(bucket_name, object_name, size)
+        else:
+            first, last = int(first), int(last)
+            if not first <= last < size or last - first + 1 != length:
+                return Response({'error': 'Invalid Content-Range'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                received = backend.write_chunk(
+                    bucket_name, object_name, first, read_body(request, length), size)
+            except FileExistsError:
+                return Response({'error': 'The object already exists'},
+                                status=status.HTTP_412_PRECONDITION_FAILED)
+        if received >= size:
+            return HttpResponse(status=status.HTTP_200_OK)
+        response = HttpResponse(status=status.HTTP_308_PERMANENT_REDIRECT)
+        if received:
+            response['Range'] = f'bytes=0-{received - 1}'
+        return response
+
+
+
+
+
+
+
+def build_item(user, data):
+    """
+    Unsaved Post or Media for one AddItemView payload, with the tag IDs to link.
+    """
+    content = data.get('content')
+    created_time = data.get('created_time', None)
+    media_url = data.get('media_url')
+    tags = data.get('tags', [])
+    is_media = data.get('is_media', False)
+
+    try:
+        tags = [int(tag_id) for tag_id in tags]
+    except (TypeError, ValueError):
+        raise ValidationError({'error': 'tags must be a list of tag ids'})
+    if not created_time:
+        created_time = datetime.now().isoformat()
+    try:
+        created_datetime = datetime.fromisoformat(created_time)
+    except (TypeError, ValueError):
+        raise ValidationError({'error': 'Invalid created_time'})
+
+    if not is_media:
+        item = Post(user=user, content=content, created_time=created_datetime)
+    else:
+        if not media_url:
+            raise ValidationError({'error': 'Missing media_url'})
+        media_type = 'video' if media_url.lower().endswith(('.mp4', '.avi', '.mov')) else 'image'
+        # Shared CustomGoogleCloudStorage instance
+        custom_url = default_storage.url(media_url.split('/')[-1])
+        item = Media(
+            user=user,
+            caption=content if content else '',
+            media_type=media_type,
+            permalink=custom_url,  # Use the custom URL
+            shortcode=media_url.split('/')[-1],
+            storage_file=custom_url,  # Ensure this is correct
+            is_published=True,
+            category=1
+        )
+    return item, list(dict.fromkeys(tags))
+
+
+def create_items(user, payloads):
+    """
+    Creates the items of several AddItemView payloads atomically: one query to
+    validate every tag ID, then one bulk insert per table.
+    """
+    items = [build_item(user, data) for data in payloads]
+
+    tag_ids = {tag_id for _, item_tags in items for tag_id in item_tags}
+    existing = set(Tag.objects.filter(
+        id__in=tag_ids).values_list('id', flat=True))
+    missing = tag_ids - existing
+    if missing:
+        raise ValidationError(
+            {'error': f"Unknown tag ids: {', '.join(map(str, sorted(missing)))}"})
+
+    posts = [(item, item_tags) for item, item_tags in items if isinstance(item, Post)]
+    media = [(item, item_tags) for item, item_tags in items if isinstance(item, Media)]
+    with transaction.atomic():
+        Post.objects.bulk_create(
+            [item for item, _ in posts], batch_size=1000)
+        Media.objects.bulk_create(
+            [item for item, _ in media], batch_size=1000)
+        PostTag.objects.bulk_create([
+            PostTag(post=item, tag_id=tag_id)
+            for item, item_tags in posts for tag_id in item_tags
+        ], batch_size=1000)
+        MediaTag.objects.bulk_create([
+            MediaTag(media=item, tag_id=tag_id)
+            for item, item_tags in media for tag_id in item_tags
+        ], batch_size=1000)
+        publish_on_commit(CREATED, [item for item, _ in items])
+        media_processing.enqueue(item.pk for item, _ in media)
+        # bulk_create sends no signals
+        if any(item_tags for _, item_tags in items):
+            tag_cache.invalidate(tag_cache.user_tags(user.id))
+    return [item for item, _ in items]
+
 
 class AddItemView(APIView):
     permission_classes = [IsAuthenticated]
@@ -258,50 +771,128 @@ class AddItemView(APIView):
         if not request.user.is_authenticated:
             return Response({'error': 'Unauthorized'}, status=403)
 
-        content = request.data.get('content')
-        created_time = request.data.get('created_time', None)
-        media_url = request.data.get('media_url')
-        tags = request.data.get('tags', [])
-        is_media = request.data.get('is_media', False)
+        try:
+            item, = create_items(request.user, [request.data])
+            return Response({'message': 'Item added successfully', 'id': item.id})
+        except ValidationError:
+            raise
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
+
+
+class AddItemBatchView(APIView):
+    """Creates many posts and media in one transaction, e.g. for imports."""
+    permission_classes = [IsAuthenticated]
+    max_items = 5000
+
+    def post(self, request, *args, **kwargs):
+        payloads = request.data.get('items')
+        if not isinstance(payloads, list) or not all(
+                isinstance(data, dict) for data in payloads):
+            raise ValidationError({'error': 'items must be a list of objects'})
+        if len(payloads) > self.max_items:
+            raise ValidationError(
+                {'error': f'At most {self.max_items} items per request'})
 
         try:
-            user = request.user
-            if not created_time:
-                created_time = datetime.now().isoformat()
-            created_datetime = datetime.fromisoformat(created_time)
-
-            if not is_media:
-                post = Post.objects.create(user=user, content=content, created_time=created_datetime)
-                for tag_id in tags:
-                    tag = Tag.objects.get(id=tag_id)
-                    PostTag.objects.create(post=post, tag=tag)
-            else:
-                media_type = 'video' if media_url.lower().endswith(('.mp4', '.avi', '.mov')) else 'image'
-                storage = CustomGoogleCloudStorage()
-                # Ensure the URL is stored correctly
-                custom_url = storage.url(media_url.split('/')[-1])
-                media = Media.objects.create(
-                    user=user,
-                    caption=content if content else '',
-                    media_type=media_type,
-                    permalink=custom_url,  # Use the custom URL
-                    shortcode=media_url.split('/')[-1],
-                    storage_file=custom_url,  # Ensure this is correct
-                    is_published=True,
-                    category=1
-                )
-                for tag_id in tags:
-                    tag = Tag.objects.get(id=tag_id)
-                    MediaTag.objects.create(media=media, tag=tag)
-
-            return Response({'message': 'Item added successfully'})
+            items = create_items(request.user, payloads)
+        except ValidationError:
+            raise
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
+        return Response({
+            'message': 'Items added successfully',
+            'posts': [item.id for item in items if isinstance(item, Post)],
+            'media': [item.id for item in items if isinstance(item, Media)],
+        }, status=status.HTTP_201_CREATED)
+
 
 
 
 
+class UploadSessionViewSet(PermissionMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable uploads straight to the bucket. create opens a GCS session the
+    client PUTs chunks to, retrieve tells how many bytes GCS has so an
+    interrupted upload resumes from there, and finalise verifies the object's
+    size and MD5 before creating its Media, deduplicated by SHA-256.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        object_name = upload_object_name(data.pop('filename'))
+        origin = self.request.headers.get('Origin')
+        if origin not in settings.CORS_ALLOWED_ORIGINS:
+            origin = None
+        session_url = start_session(
+            settings.GS_BUCKET_NAME, object_name, data['content_type'], data['size'], origin)
+        serializer.save(user=self.request.user, object_name=object_name, session_url=session_url)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['chunk_size'] = settings.UPLOAD_CHUNK_SIZE
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        upload = self.get_object()
+        data = self.get_serializer(upload).data
+        if upload.media_id is not None:
+            data['received'] = upload.size
+        else:
+            try:
+                data['received'] = received_bytes(upload.session_url, upload.size)
+            except Exception as e:
+                return Response({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(data)
+
+    @action(detail=True, methods=['post'])
+    def finalise(self, request, *args, **kwargs):
+        """Creates the Media of a complete upload, with content, tags and created_time as in items/add/."""
+        upload = self.get_object()
+        # Idempotent, a retried finalise returns the same Media
+        if upload.media_id is None:
+            # Both read the whole object, before any row is locked
+            try:
+                verify_upload(settings.GS_BUCKET_NAME, upload.object_name, upload.size, upload.md5_hash)
+            except UploadNotFinished as e:
+                return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+            except UploadCorrupted as e:
+                upload.delete()
+                return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            sha256 = stored_objects.content_hash(upload.object_name)
+            with transaction.atomic():
+                upload = UploadSession.objects.select_for_update().get(pk=upload.pk)
+                # A concurrent finalise may have got here first
+                if upload.media_id is None:
+                    payload = {name: request.data[name] for name in ('content', 'tags', 'created_time')
+                               if name in request.data}
+                    # Points at the user's existing object when they uploaded the same bytes before
+                    stored = stored_objects.claim(request.user, upload.object_name, upload.size, sha256)
+                    upload.media, = create_items(request.user, [{
+                        **payload, 'is_media': True, 'media_url': stored.object_name}])
+                    Media.objects.filter(pk=upload.media.pk).update(stored_object=stored)
+                    upload.save(update_fields=['media'])
+        return Response(self.get_serializer(upload).data)
+
+
+class MetricsView(APIView):
+    """
+    p50/p95/p99 per view of the requests seen by this process, recorded by
+    PerformanceMiddleware when PERF_INSTRUMENTATION is on.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'enabled': settings.PERF_INSTRUMENTATION,
+            'views': metrics.registry.snapshot(),
+        })
+
+
 class PasswordResetRequestView(APIView):
     permission_classes = [AllowAny]
 
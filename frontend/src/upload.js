@@ -0,0 +1,117 @@
+import axios from '@/axios.js';
+
+const RETRY_DELAYS = [1000, 2000, 5000, 10000, 30000];
+
+// Incremental MD5 (RFC 1321), the server checks the uploaded object against it
+const S = [7, 12, 17, 22, 5, 9, 14, 20, 4, 11, 16, 23, 6, 10, 15, 21];
+const K = Array.from({ length: 64 }, (_, i) => Math.floor(Math.abs(Math.sin(i + 1)) * 2 ** 32) >>> 0);
+
+class MD5 {
+    constructor() {
+        this.state = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476];
+        this.buffer = new Uint8Array(64);
+        this.buffered = 0;
+        this.length = 0;
+    }
+
+    block(bytes, offset) {
+        const words = new Uint32Array(16);
+        for (let i = 0; i < 16; i++) {
+            const j = offset + i * 4;
+            words[i] = bytes[j] | (bytes[j + 1] << 8) | (bytes[j + 2] << 16) | (bytes[j + 3] << 24);
+        }
+        let [a, b, c, d] = this.state;
+        for (let i = 0; i < 64; i++) {
+            let f, g;
+            if (i < 16) { f = (b & c) | (~b & d); g = i; }
+            else if (i < 32) { f = (d & b) | (~d & c); g = (5 * i + 1) % 16; }
+            else if (i < 48) { f = b ^ c ^ d; g = (3 * i + 5) % 16; }
+            else { f = c ^ (b | ~d); g = (7 * i) % 16; }
+            const sum = (a + f + K[i] + words[g]) >>> 0;
+            const shift = S[(i >> 4) * 4 + (i % 4)];
+            a = d; d = c; c = b;
+            b = (b + ((sum << shift) | (sum >>> (32 - shift)))) >>> 0;
+        }
+        this.state = this.state.map((value, i) => (value + [a, b, c, d][i]) >>> 0);
+    }
+
+    update(bytes) {
+        this.length += bytes.length;
+        let offset = 0;
+        if (this.buffered) {
+            offset = Math.min(64 - this.buffered, bytes.length);
+            this.buffer.set(bytes.subarray(0, offset), this.buffered);
+            this.buffered += offset;
+            if (this.buffered < 64) return;
+            this.block(this.buffer, 0);
+            this.buffered = 0;
+        }
+        for (; offset + 64 <= bytes.length; offset += 64) {
+            this.block(bytes, offset);
+        }
+        this.buffer.set(bytes.subarray(offset), 0);
+        this.buffered = bytes.length - offset;
+    }
+
+    base64() {
+        const bits = this.length * 8;
+        const padding = new Uint8Array(((this.buffered < 56 ? 56 : 120) - this.buffered) + 8);
+        padding[0] = 0x80;
+        for (let i = 0; i < 8; i++) {
+            padding[padding.length - 8 + i] = Math.floor(bits / 2 ** (8 * i)) & 0xff;
+        }
+        this.update(padding);
+        const digest = new Uint8Array(16);
+        this.state.forEach((value, i) => {
+            for (let j = 0; j < 4; j++) digest[i * 4 + j] = (value >>> (8 * j)) & 0xff;
+        });
+        return btoa(String.fromCharCode(...digest));
+    }
+}
+
+async function fileMd5(file, chunkSize) {
+    const md5 = new MD5();
+    for (let start = 0; start < file.size; start += chunkSize) {
+        md5.update(new Uint8Array(await file.slice(start, start + chunkSize).arrayBuffer()));
+    }
+    return md5.base64();
+}
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+// Uploads file through a resumable session in chunks. A failed chunk asks the
+// server how much GCS kept and resumes from there. Resolves with the session.
+export async function resumableUpload(file, onProgress = () => {}) {
+    const { data: upload } = await axios.post('/uploads/', {
+        filename: file.name,
+        content_type: file.type,
+        size: file.size,
+        md5_hash: await fileMd5(file, 4 * 1024 * 1024),
+    });
+
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        const end = Math.min(offset + upload.chunk_size, file.size);
+        try {
+            const response = await fetch(upload.session_url, {
+                method: 'PUT',
+                body: file.slice(offset, end),
+                headers: { 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}` },
+            });
+            // 308 asks for the next chunk, 200/201 ends the upload
+            if (response.status !== 308 && !response.ok) {
+                throw new Error(`Chunk rejected with status ${response.status}`);
+            }
+            offset = end;
+            failures = 0;
+        } catch (error) {
+            if (failures >= RETRY_DELAYS.length) throw error;
+            await sleep(RETRY_DELAYS[failures++]);
+            const { data } = await axios.get(`/uploads/${upload.id}/`);
+            offset = data.received;
+        }
+        onProgress(offset / file.size);
+    }
+    return upload;
+}